@@ -1,15 +1,96 @@
+import importlib
+import os
+import threading
+import time
 import streamlit as st
-import pandas as pd
-import numpy as np
-import joblib
-import shap
-import matplotlib.pyplot as plt
+import timings
+from features import FEATURE_NAMES, compute_features, measurement_array
+from model_registry import MODEL_FILE, REGISTRY_DIR, LoadedModel, RegistryWatcher, current_version, version_dir
+from percentiles import PERCENTILES_PATH, PercentileIndex
+from prediction_cache import CachedPrediction, PredictionCache
+from request_log import get_request_log
+from tree_eval import trees_path_for
 
 st.set_page_config(page_title="Worminator", layout="wide")
 
-MODEL_PATH = 'model/model.joblib'
-model = joblib.load(MODEL_PATH)
-explainer = shap.TreeExplainer(model)
+#WORMINATOR_MODEL=distilled serves the small surrogate from train_model.py --distill instead of the full model,
+#about half the shap cost for ~99% agreement with the full model (the trade-off table is printed when distilling).
+#it only picks between these files, when a model registry exists its CURRENT version is served instead.
+MODEL_PATHS = {'full': 'model/model.joblib', 'distilled': 'model/model_distilled.joblib'}
+MODEL_CHOICE = os.environ.get('WORMINATOR_MODEL', 'full')
+if MODEL_CHOICE not in MODEL_PATHS:
+    st.error(f"WORMINATOR_MODEL must be one of {', '.join(MODEL_PATHS)}, not '{MODEL_CHOICE}'.")
+    st.stop()
+MODEL_PATH = MODEL_PATHS[MODEL_CHOICE]
+PREDICTION_CACHE_SIZE = int(os.environ.get('WORMINATOR_CACHE_SIZE', 256))
+#WORMINATOR_TIMINGS=1 times every stage of a click, WORMINATOR_METRICS_PATH=metrics/app.prom (or .json) exports them
+#every WORMINATOR_METRICS_INTERVAL seconds from a background thread, not from the clicks themselves.
+timer = timings.get_timer('app')
+if timings.METRICS_PATH:
+    timer.start_exporter(timings.METRICS_PATH)
+
+#matplotlib and xgboost are only needed once the button is pressed, so the form renders without them.
+#a background thread imports them while the user is typing, import_cost.py measures what each one costs.
+HEAVY_MODULES = ['joblib', 'xgboost', 'matplotlib.figure']
+
+def import_heavy_modules():
+    for name in HEAVY_MODULES:
+        importlib.import_module(name)
+
+#once per process. a click before it finishes waits for it (join) instead of importing the same modules from two threads.
+@st.cache_resource(show_spinner=False)
+def start_background_imports():
+    thread = threading.Thread(target=import_heavy_modules, name='worminator-imports', daemon=True)
+    thread.start()
+    return thread
+
+#the explanations come from explain.py, xgboost's own treeshap by default so shap isn't imported at all
+#(WORMINATOR_EXPLAIN_BACKEND=shap switches back to shap.TreeExplainer).
+#the model and explainer are loaded once per process and shared by every session and rerun.
+#the file's modification time is part of the cache key, so a retrained model.joblib gets picked up on the next rerun
+#and the old one is dropped (max_entries=1). load_model.clear() / load_explainer.clear() force a reload.
+@st.cache_resource(max_entries=1, show_spinner=False)
+def load_model(path, modified_time):
+    import joblib
+    return joblib.load(path)
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def load_explainer(path, modified_time):
+    from explain import make_explainer
+    return make_explainer(load_model(path, modified_time))
+
+#the compiled trees train_model.py exports next to the model, single row predictions come from them (tree_eval.py).
+#None if they are missing or were exported from another model, then xgboost predicts. the trees' modification time
+#is in the key too, trees written after the model (train_model.py saves the model first) are picked up on the next rerun.
+@st.cache_resource(max_entries=1, show_spinner=False)
+def load_forest(path, modified_time, trees_modified_time):
+    from tree_eval import load_for_model
+    return load_for_model(load_model(path, modified_time), path)
+
+#with a model registry (model_registry.py, WORMINATOR_REGISTRY) the app serves its CURRENT version and a background
+#thread swaps in newly promoted versions, no restart needed. without one it loads MODEL_PATH like before.
+use_registry = current_version(REGISTRY_DIR) is not None
+
+#started on the first click, after the background imports, so two threads never import xgboost at once.
+@st.cache_resource(show_spinner=False)
+def get_registry_watcher(registry_dir):
+    if 'WORMINATOR_MODEL' in os.environ:
+        print(f"WORMINATOR_MODEL={MODEL_CHOICE} is ignored, the model registry in {registry_dir} takes precedence")
+    return RegistryWatcher(registry_dir).start()
+
+#the model and explainer for one click. the click keeps this LoadedModel until it is done,
+#a new version swapped in meanwhile is used from the next click on.
+def active_model():
+    with timer.stage('imports'):
+        start_background_imports().join()
+    with timer.stage('load'):
+        if use_registry:
+            return get_registry_watcher(REGISTRY_DIR).get()
+        modified_time = os.path.getmtime(MODEL_PATH)
+        trees_path = trees_path_for(MODEL_PATH)
+        trees_modified_time = os.path.getmtime(trees_path) if os.path.exists(trees_path) else None
+        return LoadedModel(f"{MODEL_PATH}@{modified_time}", load_model(MODEL_PATH, modified_time),
+                           load_explainer(MODEL_PATH, modified_time), None, load_forest(MODEL_PATH, modified_time, trees_modified_time))
 
 #CSS
 st.markdown("""
@@ -132,81 +213,92 @@ ratio_descriptions = {
 }
 
 # Interpretation
-interpretation_templates = {
-    'WHR': {
-        'male': "Your waist to hip ratio is higher than average for females, indicating a less pronounced waist relative to hips, leaning towards male.",
-        'female': "Your waist to hip ratio is lower than average for males, indicating a more pronounced waist relative to hips, leaning towards female."
-    },
-    'HBS': {
-        'male': "Your hip breadth to stature ratio is low, suggesting narrower hips relative to your height, leaning towards male.",
-        'female': "Your hip breadth to stature ratio is high, suggesting wider hips relative to your height, leaning towards female."
-    },
-    'CS': {
-        'male': "Your chest circumference is large relative to your height, leaning towards male.",
-        'female': "Your chest circumference is small relative to your height, leaning towards female."
-    },
-    'FSR': {
-        'male': "Your forearm circumference (flexed) is large relative to your height, leaning towards male.",
-        'female': "Your forearm circumference (flexed) is small relative to your height, leaning towards female."
-    },
-    'CBR': {
-        'male': "Your calf circumference is large relative to your buttock circumference, leaning towards male.",
-        'female': "Your calf circumference is small relative to your buttock circumference, leaning towards female."
-    },
-    'BBSR': {
-        'male': "Your shoulder breadth is wide relative to your height, leaning towards male.",
-        'female': "Your shoulder breadth is narrow relative to your height, leaning towards female."
-    },
-    'BBHB': {
-        'male': "Your shoulder breadth is wide relative to your hip breadth, leaning towards male.",
-        'female': "Your shoulder breadth is narrow relative to your hip breadth, leaning towards female."
-    },
-    'ANKLS': {
-        'male': "Your ankle circumference is large relative to your height, leaning towards male.",
-        'female': "Your ankle circumference is small relative to your height, leaning towards female."
-    },
-    'FLS': {
-        'male': "Your forearm-hand length is long relative to your height, leaning towards male.",
-        'female': "Your forearm-hand length is short relative to your height, leaning towards female."
-    },
-    'WCS': {
-        'male': "Your wrist circumference is large relative to your height, leaning towards male.",
-        'female': "Your wrist circumference is small relative to your height, leaning towards female."
-    }
-}
+#where each ratio falls among ANSUR II women and men, from the percentile index train_model.py writes (percentiles.py).
+#loaded once per process, a lookup is a binary search. without the file the app just leaves this text out.
+@st.cache_resource(max_entries=1, show_spinner=False)
+def load_percentile_index(path, modified_time):
+    return PercentileIndex.load(path)
+
+def percentile_text(index, feature_name, value):
+    percentiles, closer = index.describe(feature_name, value)
+    typical = {'female': 'woman', 'male': 'man'}[closer]
+    return (f"Higher than {percentiles['female']:.0f}% of women and {percentiles['male']:.0f}% of men in the ANSUR II survey, "
+            f"closer to the typical {typical}.")
+
+#the dataset wide shap summary global_explain.py caches next to the model, read once per model and report file.
+#nothing is computed per click, without a report (or with one for another model) the section is left out.
+@st.cache_resource(max_entries=2, show_spinner=False)
+def load_global_report(model_path, model_modified_time, report_modified_time):
+    from global_explain import load_report
+    return load_report(model_path)
+
+def global_report_for(active):
+    from global_explain import report_path
+    model_path = os.path.join(version_dir(active.version, REGISTRY_DIR), MODEL_FILE) if use_registry else MODEL_PATH
+    path = report_path(model_path)
+    if not os.path.exists(path):
+        return None
+    return load_global_report(model_path, os.path.getmtime(model_path), os.path.getmtime(path))
+
+def global_report_text(report):
+    lines = [f"Average impact on the prediction over {report['rows']} subjects (mean |SHAP|, and the average push for women / men):", ""]
+    for rank, name in enumerate(report['ranking'], start=1):
+        female = report['by_gender']['female']['mean_shap'][name]
+        male = report['by_gender']['male']['mean_shap'][name]
+        lines.append(f"{rank}. **{name}**: {report['mean_abs_shap'][name]:.2f} (women {female:+.2f}, men {male:+.2f})")
+    if report['interactions']:
+        lines += ["", "Strongest interactions between features:", ""]
+        lines += [f"- {' x '.join(pair['features'])}: {pair['mean_abs']:.2f}" for pair in report['interactions'][:3]]
+    return '\n'.join(lines)
+
+#Probability, shap values and the rendered bar chart for one set of measurements.
+#The ratios come from features.py, the same transform train_model.py trains on (inputs are cm, the model wants mm).
+def predict_and_explain(measurements, model, explainer, forest=None):
+    from explain import render_bar_chart
+
+    with timer.stage('features'):
+        user_features = compute_features(measurement_array(measurements), scale=10)
+
+    with timer.stage('predict'):
+        predictor = forest if forest is not None else model
+        passing_probability = predictor.predict_proba(user_features)[0][0] * 100  # Assuming class 0 is female
+    with timer.stage('shap'):
+        shap_values = explainer.shap_values(user_features)
+
+    with timer.stage('chart'):
+        chart = render_bar_chart(shap_values[0], user_features[0], FEATURE_NAMES)
+
+    return CachedPrediction(passing_probability, dict(zip(FEATURE_NAMES, user_features[0])), shap_values[0], chart)
+
+#Repeated submissions are served from an lru cache shared by all sessions, size set with WORMINATOR_CACHE_SIZE.
+#The model's version is part of the key so a new model starts with an empty cache.
+@st.cache_resource(max_entries=1, show_spinner=False)
+def get_prediction_cache(size, model_version):
+    return PredictionCache(size)
+
+start_background_imports()
 
 if st.button("Worm me!"):
     if any(value == 0.0 for value in measurements.values()):
         st.error("Please provide all measurements.")
     else:
         with st.spinner('Analyzing...'):
-            #Calculate ratio.
-            def calculate_user_ratio_features(measurements):
-                measurements = {key: value * 10 for key, value in measurements.items()}
-                for key in measurements:
-                    if measurements[key] == 0:
-                        measurements[key] = 0.1  
-
-                ratio_features = {
-                    'WHR': measurements["waistcircumference"] / measurements["buttockcircumference"],
-                    'HBS': measurements["hipbreadth"] / measurements["stature"],
-                    'CS': measurements["chestcircumference"] / measurements["stature"],
-                    'FSR': measurements["forearmcircumferenceflexed"] / measurements["stature"],
-                    'CBR': measurements["calfcircumference"] / measurements["buttockcircumference"],
-                    'BBSR': measurements["biacromialbreadth"] / measurements["stature"],
-                    'BBHB': measurements["biacromialbreadth"] / measurements["hipbreadth"],
-                    'ANKLS': measurements["anklecircumference"] / measurements["stature"],
-                    'FLS': measurements["forearmhandlength"] / measurements["stature"],
-                    'WCS': measurements["wristcircumference"] / measurements["stature"]
-                }
-                return ratio_features
-
-            user_ratios = calculate_user_ratio_features(measurements)
-            user_input = {**user_ratios, 'stature': measurements["stature"] * 10}
-            user_df = pd.DataFrame([user_input])
+            cache_key = PredictionCache.make_key(measurements[name] for name in sorted(measurements))
+            request_started = time.perf_counter()
+            with timer.stage('request'):
+                active = active_model()
+                prediction_cache = get_prediction_cache(PREDICTION_CACHE_SIZE, active.version)
+                result = prediction_cache.get_or_compute(
+                    cache_key, lambda: predict_and_explain(measurements, active.model, active.explainer, active.forest))
+            #WORMINATOR_REQUEST_LOG=logs/requests.jsonl records every click for replay.py, the write happens in the background.
+            request_log = get_request_log()
+            if request_log is not None:
+                request_log.record('app', 'explain', dict(measurements),
+                                   {'total': (time.perf_counter() - request_started) * 1000}, model=active.version)
+            display_started = timer.start()
 
             #Probability.
-            passing_probability = model.predict_proba(user_df)[0][0] * 100  # Assuming class 0 is female
+            passing_probability = result.probability
             st.subheader("Prediction Result")
 
             #Result color based on probability.
@@ -240,12 +332,14 @@ if st.button("Worm me!"):
             </div>
             """, unsafe_allow_html=True)
         #SHAP
-        shap_values = explainer.shap_values(user_df)
         col_left, col_right = st.columns([1, 1])
 
         with col_left:
             st.subheader("Feature Interpretations")
-            for feature_name, shap_value in zip(user_df.columns, shap_values[0]):
+            percentile_index = None
+            if os.path.exists(PERCENTILES_PATH):
+                percentile_index = load_percentile_index(PERCENTILES_PATH, os.path.getmtime(PERCENTILES_PATH))
+            for feature_name, shap_value in zip(FEATURE_NAMES, result.shap_values):
         # Get the full description of the feature
                 if feature_name in ratio_descriptions:
                     full_name = f"{feature_name} ({ratio_descriptions[feature_name]})"
@@ -257,7 +351,7 @@ if st.button("Worm me!"):
 
                 if feature_name == 'stature':
                 # Convert 'stature' from mm to cm
-                    feature_value_cm = user_df[feature_name].iloc[0] / 10  # Convert mm to cm
+                    feature_value_cm = result.feature_values[feature_name] / 10  # Convert mm to cm
             # Basic interpretation
                     interpretation = f"""
                     <p style='color: var(--text-color);'>
@@ -269,9 +363,13 @@ if st.button("Worm me!"):
             # Add 'Heighthon' interpretation if stature > 178 cm
                     if feature_value_cm > 178:
                         st.markdown("<p style='color: var(--text-color);'>Heighthon</p>", unsafe_allow_html=True)
+
+                    if percentile_index is not None:
+                        detailed_text = f"<p style='color: var(--text-color);'>{percentile_text(percentile_index, feature_name, result.feature_values[feature_name])}</p>"
+                        st.markdown(detailed_text, unsafe_allow_html=True)
                 else:
                 # For other features
-                    feature_value = user_df[feature_name].iloc[0]
+                    feature_value = result.feature_values[feature_name]
                 # Basic interpretation
                     interpretation = f"""
                     <p style='color: var(--text-color);'>
@@ -280,24 +378,18 @@ if st.button("Worm me!"):
                     """
                     st.markdown(interpretation, unsafe_allow_html=True)
 
-            # Add detailed interpretation if available
-                    if feature_name in interpretation_templates:
-                        detailed_interpretation = interpretation_templates[feature_name][direction]
-                        detailed_text = f"<p style='color: var(--text-color);'>{detailed_interpretation}</p>"
+            # Add where the ratio sits in the population
+                    if percentile_index is not None:
+                        detailed_text = f"<p style='color: var(--text-color);'>{percentile_text(percentile_index, feature_name, feature_value)}</p>"
                         st.markdown(detailed_text, unsafe_allow_html=True)
 
         with col_right:
             st.subheader("Feature Impact on Prediction")
-            plt.figure(figsize=(8, 6))
-            shap.plots.bar(
-                shap.Explanation(
-                    values=shap_values[0],
-                    base_values=explainer.expected_value,
-                    data=user_df.iloc[0],
-                    feature_names=user_df.columns
-                ),
-                max_display=len(user_df.columns),
-                show=False
-            )
-            st.pyplot(plt)
-            
\ No newline at end of file
+            st.image(result.chart_png)
+
+            global_report = global_report_for(active)
+            if global_report is not None:
+                with st.expander("Across all ANSUR II subjects"):
+                    st.markdown(global_report_text(global_report))
+
+        timer.stop('display', display_started)
@@ -0,0 +1,100 @@
+#batch scoring, scores whole csv files instead of one person at a time through the app.
+#works with ansur style files (mm, ansur or lowercase column names) and app style files (cm, lowercase names).
+#the file is streamed in chunks so memory stays flat no matter how big the input is.
+#usage: python batch_score.py input.csv output.csv [--units cm] [--shap] [--id-column SubjectId]
+import argparse
+import time
+
+import joblib
+import pandas as pd
+
+from explain import EXPLAIN_BACKENDS, make_explainer
+from features import ANSUR_COLUMN_MAPPING, FEATURE_NAMES, REQUIRED_MEASUREMENTS, compute_feature_matrix
+
+MODEL_PATH = 'model/model.joblib'
+CHUNK_SIZE = 50_000
+
+#mm per input unit.
+UNIT_SCALES = {'mm': 1.0, 'cm': 10.0}
+
+
+#only read the columns we need, under either naming scheme.
+def wanted_columns(id_column=None):
+    wanted = set(REQUIRED_MEASUREMENTS)
+    wanted |= {ansur for ansur, name in ANSUR_COLUMN_MAPPING.items() if name in REQUIRED_MEASUREMENTS}
+    if id_column:
+        wanted.add(id_column)
+    return wanted
+
+
+#nobody is shorter than 30 cm or taller than 300 cm, so stature tells the units apart.
+def guess_units(chunk):
+    return 'mm' if chunk['stature'].median() > 300 else 'cm'
+
+
+def score_chunk(model, chunk, scale, explainer=None):
+    X = compute_feature_matrix(chunk, scale=scale)
+    result = {'prob_female': model.predict_proba(X)[:, 0]}  # class 0 is female
+
+    if explainer is not None:
+        shap_values = explainer.shap_values(X)
+        for i, name in enumerate(FEATURE_NAMES):
+            result[f'shap_{name}'] = shap_values[:, i]
+
+    return pd.DataFrame(result, index=chunk.index)
+
+
+def score_file(input_path, output_path, model, units='auto', with_shap=False, id_column=None, chunk_size=CHUNK_SIZE,
+               explain_backend=None):
+    explainer = make_explainer(model, explain_backend) if with_shap else None
+
+    wanted = wanted_columns(id_column)
+    reader = pd.read_csv(input_path, usecols=lambda column: column in wanted, chunksize=chunk_size)
+
+    rows = 0
+    scale = None
+    for chunk_number, chunk in enumerate(reader):
+        chunk = chunk.rename(columns=ANSUR_COLUMN_MAPPING)
+        missing = [name for name in REQUIRED_MEASUREMENTS if name not in chunk.columns]
+        if missing:
+            raise ValueError(f"{input_path} is missing measurements: {', '.join(missing)}")
+
+        #decide the units once from the first chunk so every row is treated the same.
+        if scale is None:
+            scale = UNIT_SCALES[guess_units(chunk) if units == 'auto' else units]
+
+        scored = score_chunk(model, chunk, scale, explainer)
+        if id_column:
+            scored.insert(0, id_column, chunk[id_column].to_numpy())
+
+        first = chunk_number == 0
+        scored.to_csv(output_path, mode='w' if first else 'a', header=first, index=False, float_format='%.6g')
+        rows += len(chunk)
+
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a csv file of measurements with the worminator model.")
+    parser.add_argument('input', help="csv file with one subject per row")
+    parser.add_argument('output', help="where to write the probabilities")
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--units', choices=['auto', 'mm', 'cm'], default='auto',
+                        help="units of the input measurements, ansur files are in mm, the app uses cm")
+    parser.add_argument('--shap', action='store_true', help="also write the shap value of every feature")
+    parser.add_argument('--explain-backend', choices=EXPLAIN_BACKENDS, help="defaults to WORMINATOR_EXPLAIN_BACKEND or xgboost")
+    parser.add_argument('--id-column', help="column to copy to the output so rows can be matched up")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    model = joblib.load(args.model)
+
+    start = time.perf_counter()
+    rows = score_file(args.input, args.output, model, units=args.units, with_shap=args.shap,
+                      id_column=args.id_column, chunk_size=args.chunk_size, explain_backend=args.explain_backend)
+    elapsed = time.perf_counter() - start
+    print(f"Scored {rows} rows in {elapsed:.2f}s ({rows / max(elapsed, 1e-9):.0f} rows/s), written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#benchmarks for every stage, from loading the csvs to rendering the chart in the app.
+#results go to a json file, compare checks them against a stored baseline and exits with 1 on a regression.
+#usage: python benchmarks.py run [--quick] [--output bench_results.json] [--save-baseline]
+#       python benchmarks.py compare bench_results.json [--baseline bench_baseline.json] [--threshold 0.15]
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+RESULTS_PATH = "bench_results.json"
+BASELINE_PATH = "bench_baseline.json"
+BATCH_SIZES = [1, 100, 10_000, 1_000_000]
+#differences smaller than this are timer noise, never a regression.
+MIN_DELTA_SECONDS = 50e-6
+
+
+def measure(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return {
+        'median_s': statistics.median(samples),
+        'min_s': min(samples),
+        'max_s': max(samples),
+        'repeat': repeat,
+    }
+
+
+#n rows of model input, resampled from ansur with noise like synth_data.py.
+def feature_rows(n):
+    from features import compute_features
+    from synth_data import synthetic_chunks
+
+    measurements, _ = next(synthetic_chunks(n, chunk_rows=n, seed=1))
+    return compute_features(measurements)
+
+
+def run_benchmarks(quick=False):
+    import joblib
+    import pandas as pd
+    from explain import make_explainer, render_bar_chart
+    from features import FEATURE_NAMES
+    from train_model import (FEMALE_DATA_PATH, MALE_DATA_PATH, MODEL_SAVE_PATH, TUNED_HYPERPARAMETERS,
+                             calculate_ratio_features, load_and_preprocess_data, prepare_training_data, train_model)
+
+    repeat = 3 if quick else 10
+    results = {}
+
+    def record(name, stats, rows=None):
+        if rows:
+            stats['rows'] = rows
+            stats['rows_per_s'] = rows / stats['median_s']
+        results[name] = stats
+        print(f"{name:<28} {stats['median_s'] * 1000:10.3f} ms" + (f"  ({stats['rows_per_s']:,.0f} rows/s)" if rows else ''))
+
+    #loading.
+    record('csv_load', measure(lambda: (pd.read_csv(FEMALE_DATA_PATH), pd.read_csv(MALE_DATA_PATH)), repeat))
+    df = load_and_preprocess_data(FEMALE_DATA_PATH, MALE_DATA_PATH)
+    record('feature_store_load', measure(lambda: load_and_preprocess_data(FEMALE_DATA_PATH, MALE_DATA_PATH), repeat))
+
+    #features and training.
+    record('ratio_features', measure(lambda: calculate_ratio_features(df), repeat * 10), rows=len(df))
+    X, y = prepare_training_data(df, calculate_ratio_features(df))
+    #always the fixed hyperparameters, a new best_params.json must not show up as a regression.
+    record('model_fit', measure(lambda: train_model(X, y, dict(TUNED_HYPERPARAMETERS)), 1 if quick else 3, warmup=0), rows=len(X))
+
+    #serialization, with the shipped model.
+    model = joblib.load(MODEL_SAVE_PATH)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'model.joblib')
+        record('joblib_save', measure(lambda: joblib.dump(model, path), repeat))
+        record('joblib_load', measure(lambda: joblib.load(path), repeat))
+
+    #prediction.
+    single = X.iloc[[0]]
+    record('predict_single', measure(lambda: model.predict_proba(single), repeat * 20))
+    for n in BATCH_SIZES:
+        if quick and n > 10_000:
+            continue
+        rows = feature_rows(n)
+        record(f'predict_batch_{n}', measure(lambda: model.predict_proba(rows), max(1, repeat // (1 + n // 100_000))), rows=n)
+
+    from tree_eval import COMPILED_TREES_PATH, CompiledForest
+    if os.path.exists(COMPILED_TREES_PATH):
+        forest = CompiledForest.load()
+        single_array = single.to_numpy()
+        record('predict_single_compiled', measure(lambda: forest.predict_proba(single_array), repeat * 20))
+
+    #explanations and the chart the app draws.
+    for backend in ('xgboost', 'shap'):
+        try:
+            explainer = make_explainer(model, backend)
+        except ImportError:
+            continue
+        record(f'explain_single_{backend}', measure(lambda: explainer.shap_values(single), repeat * 5))
+    shap_values = make_explainer(model).shap_values(single)[0]
+    record('chart_render', measure(lambda: render_bar_chart(shap_values, single.iloc[0], FEATURE_NAMES), repeat))
+
+    return results
+
+
+def environment():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    import xgboost
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'revision': revision,
+        'python': platform.python_version(),
+        'xgboost': xgboost.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+#stages that got slower by more than threshold (and by more than timer noise) compared to the baseline.
+def compare(current, baseline, threshold):
+    regressions = []
+    rows = []
+    for name, stats in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            rows.append((name, None, stats['median_s'], None, 'new'))
+            continue
+        ratio = stats['median_s'] / base['median_s']
+        regressed = ratio > 1 + threshold and stats['median_s'] - base['median_s'] > MIN_DELTA_SECONDS
+        improved = ratio < 1 - threshold
+        status = 'REGRESSION' if regressed else 'faster' if improved else 'ok'
+        rows.append((name, base['median_s'], stats['median_s'], ratio, status))
+        if regressed:
+            regressions.append(name)
+
+    print(f"{'stage':<28} {'baseline ms':>12} {'current ms':>12} {'ratio':>7}")
+    for name, base, now, ratio, status in rows:
+        base_text = f"{base * 1000:12.3f}" if base is not None else f"{'-':>12}"
+        ratio_text = f"{ratio:7.2f}" if ratio is not None else f"{'-':>7}"
+        print(f"{name:<28} {base_text} {now * 1000:12.3f} {ratio_text}  {status}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worminator performance benchmarks.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="run the benchmarks")
+    run_parser.add_argument('--output', default=RESULTS_PATH)
+    run_parser.add_argument('--quick', action='store_true', help="fewer repeats, no 1M row batch")
+    run_parser.add_argument('--save-baseline', action='store_true', help=f"also store the results as {BASELINE_PATH}")
+
+    compare_parser = subparsers.add_parser('compare', help="compare results against the baseline")
+    compare_parser.add_argument('results', nargs='?', default=RESULTS_PATH)
+    compare_parser.add_argument('--baseline', default=BASELINE_PATH)
+    compare_parser.add_argument('--threshold', type=float, default=0.15, help="allowed slowdown, 0.15 is 15%%")
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        report = {'environment': environment(), 'quick': args.quick, 'results': run_benchmarks(args.quick)}
+        for path in [args.output] + ([BASELINE_PATH] if args.save_baseline else []):
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"Results written to {path}")
+        return
+
+    with open(args.results) as f:
+        current = json.load(f)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if current['environment'].get('machine') != baseline['environment'].get('machine') or \
+            current['environment'].get('cpus') != baseline['environment'].get('cpus'):
+        print("Warning: results and baseline come from different machines, the comparison is rough.")
+    regressions = compare(current, baseline, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        sys.exit(1)
+    print("No regressions.")
+
+
+if __name__ == "__main__":
+    main()
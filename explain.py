@@ -0,0 +1,117 @@
+#explanation backends and the feature impact chart, shared by the app, the batch scorer and the http service.
+#"xgboost" asks the booster for its exact treeshap contributions (pred_contribs), multithreaded and without shap.
+#"shap" is the old shap.TreeExplainer path, kept to compare latency and numbers (python explain.py --compare).
+#pick one with WORMINATOR_EXPLAIN_BACKEND, the default is xgboost.
+import io
+import os
+
+import numpy as np
+
+EXPLAIN_BACKENDS = ('xgboost', 'shap')
+DEFAULT_EXPLAIN_BACKEND = os.environ.get('WORMINATOR_EXPLAIN_BACKEND', 'xgboost')
+
+
+#same interface as shap.TreeExplainer (shap_values and expected_value) so callers don't care which backend they get.
+class XGBoostExplainer:
+    def __init__(self, model):
+        self.booster = model.get_booster()
+        self.feature_names = self.booster.feature_names
+        #the bias column is the same for every row, it's the model's expected margin.
+        self.expected_value = float(self._contributions(np.zeros((1, len(self.feature_names)), dtype=np.float32))[0, -1])
+
+    def _contributions(self, X):
+        import xgboost as xgb
+        if hasattr(X, 'columns'):
+            X = X[self.feature_names]
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        return self.booster.predict(xgb.DMatrix(X, feature_names=self.feature_names), pred_contribs=True)
+
+    #(n, features) in log odds of being male, like shap.TreeExplainer.shap_values.
+    def shap_values(self, X):
+        return self._contributions(X)[:, :-1]
+
+
+def make_explainer(model, backend=None):
+    backend = backend or DEFAULT_EXPLAIN_BACKEND
+    if backend == 'xgboost':
+        return XGBoostExplainer(model)
+    if backend == 'shap':
+        import shap
+        return shap.TreeExplainer(model)
+    raise ValueError(f"unknown explain backend {backend!r}, use one of {', '.join(EXPLAIN_BACKENDS)}")
+
+
+#horizontal bar chart of the contributions, biggest on top, in the style of shap.plots.bar. returns png bytes.
+#uses a plain Figure instead of pyplot, so nothing global is touched and sessions can render at the same time.
+def render_bar_chart(shap_values, feature_values, feature_names):
+    from matplotlib.figure import Figure
+
+    shap_values = np.asarray(shap_values, dtype=np.float64)
+    feature_values = np.asarray(feature_values, dtype=np.float64)
+    order = np.argsort(np.abs(shap_values))
+    labels = [f"{feature_values[i]:.4g} = {feature_names[i]}" for i in order]
+    values = shap_values[order]
+    colors = np.where(values > 0, '#ff0051', '#008bfb')
+
+    fig = Figure(figsize=(8, 6))
+    ax = fig.add_subplot()
+    ax.barh(np.arange(len(values)), values, color=colors)
+    ax.set_yticks(np.arange(len(values)), labels)
+    ax.axvline(0, color='#999999', linewidth=0.8)
+    span = np.abs(values).max() or 1.0
+    for y, value in enumerate(values):
+        ax.text(value + (0.02 if value > 0 else -0.02) * span, y, f"{value:+.2f}",
+                va='center', ha='left' if value > 0 else 'right', fontsize=9, color=colors[y])
+    ax.set_xlim(min(values.min(), 0) - 0.2 * span, max(values.max(), 0) + 0.2 * span)
+    ax.set_xlabel("SHAP value (impact on model output, positive leans male)")
+    for side in ('top', 'right'):
+        ax.spines[side].set_visible(False)
+
+    chart = io.BytesIO()
+    fig.savefig(chart, format='png', bbox_inches='tight')
+    return chart.getvalue()
+
+
+#latency and agreement of the two backends on the ansur data.
+def compare_backends(model, X, repeat=100):
+    import time
+
+    results = {}
+    for backend in EXPLAIN_BACKENDS:
+        explainer = make_explainer(model, backend)
+        single = X.iloc[[0]]
+        explainer.shap_values(single)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            explainer.shap_values(single)
+        single_ms = (time.perf_counter() - start) / repeat * 1000
+        start = time.perf_counter()
+        values = explainer.shap_values(X)
+        batch_ms = (time.perf_counter() - start) * 1000
+        results[backend] = (single_ms, batch_ms, values, float(np.ravel(explainer.expected_value)[0]))
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare the explanation backends.")
+    parser.add_argument('--compare', action='store_true', help="time both backends and check they agree")
+    parser.add_argument('--model', default='model/model.joblib')
+    args = parser.parse_args()
+    if not args.compare:
+        parser.error("nothing to do, pass --compare")
+
+    import joblib
+    from train_model import FEMALE_DATA_PATH, MALE_DATA_PATH, load_and_preprocess_data, calculate_ratio_features, prepare_training_data
+
+    df = load_and_preprocess_data(FEMALE_DATA_PATH, MALE_DATA_PATH)
+    X, _ = prepare_training_data(df, calculate_ratio_features(df))
+    results = compare_backends(joblib.load(args.model), X)
+
+    for backend, (single_ms, batch_ms, _, expected_value) in results.items():
+        print(f"{backend:<8} single row {single_ms:7.2f} ms, {len(X)} rows {batch_ms:8.1f} ms, expected value {expected_value:.6f}")
+    difference = np.abs(results['xgboost'][2] - results['shap'][2]).max()
+    print(f"max abs difference between backends: {difference:.2e}")
@@ -0,0 +1,108 @@
+#cached measurement store for the ansur csvs (and any csv with the same columns).
+#ingest reads only the 16 key measurements as float32 and saves them as one column-major (n, 16) .npy,
+#so every measurement is a contiguous column and later runs memory map it in milliseconds instead of parsing the csv.
+#the cache is keyed by the source file's sha256, editing or replacing the csv makes a new entry.
+#usage: python feature_store.py ingest data/*.csv  /  python feature_store.py info data/*.csv
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from features import ANSUR_COLUMN_MAPPING, KEY_MEASUREMENTS
+
+CACHE_DIR = "data/cache"
+
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _index_path(path, cache_dir):
+    return os.path.join(cache_dir, os.path.basename(path) + '.index.json')
+
+
+#hashing a big csv isn't free either, so the index remembers size and mtime and only rehashes when they change.
+def source_hash(path, cache_dir=CACHE_DIR):
+    stat = os.stat(path)
+    try:
+        with open(_index_path(path, cache_dir)) as f:
+            index = json.load(f)
+        if index['size'] == stat.st_size and index['mtime_ns'] == stat.st_mtime_ns:
+            return index['sha256']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    sha256 = file_sha256(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(_index_path(path, cache_dir), 'w') as f:
+        json.dump({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}, f)
+    return sha256
+
+
+def cache_path(path, sha256, cache_dir=CACHE_DIR):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, f"{stem}-{sha256[:16]}.npy")
+
+
+#parses the csv, only the needed columns with a fixed dtype. ansur column names are mapped for every file.
+def read_measurements_csv(path):
+    import pandas as pd
+
+    wanted = set(KEY_MEASUREMENTS) | set(ANSUR_COLUMN_MAPPING)
+    df = pd.read_csv(path, usecols=lambda column: column in wanted, dtype=np.float32)
+    df = df.rename(columns=ANSUR_COLUMN_MAPPING)
+    missing = [name for name in KEY_MEASUREMENTS if name not in df.columns]
+    if missing:
+        raise ValueError(f"{path} is missing measurements: {', '.join(missing)}")
+    #column-major so each measurement is contiguous on disk and in memory.
+    return np.asfortranarray(df[KEY_MEASUREMENTS].to_numpy(dtype=np.float32))
+
+
+def ingest(path, cache_dir=CACHE_DIR, force=False):
+    sha256 = source_hash(path, cache_dir)
+    target = cache_path(path, sha256, cache_dir)
+    if force or not os.path.exists(target):
+        measurements = read_measurements_csv(path)
+        os.makedirs(cache_dir, exist_ok=True)
+        #write then rename, a half written cache file is never picked up.
+        temporary = target + '.tmp.npy'
+        np.save(temporary, measurements)
+        os.replace(temporary, target)
+        with open(os.path.splitext(target)[0] + '.json', 'w') as f:
+            json.dump({'source': path, 'sha256': sha256, 'rows': len(measurements), 'columns': KEY_MEASUREMENTS}, f, indent=2)
+    return target
+
+
+#(n, 16) float32 measurements of a csv in KEY_MEASUREMENTS order, ingested on first use, memory mapped afterwards.
+def load_measurements(path, cache_dir=CACHE_DIR, mmap=True):
+    return np.load(ingest(path, cache_dir), mmap_mode='r' if mmap else None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest measurement csvs into the binary cache.")
+    parser.add_argument('command', choices=['ingest', 'info'])
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--force', action='store_true', help="rebuild even if the cache is up to date")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        if args.command == 'ingest':
+            target = ingest(path, args.cache_dir, args.force)
+        else:
+            target = cache_path(path, source_hash(path, args.cache_dir), args.cache_dir)
+            if not os.path.exists(target):
+                print(f"{path}: not ingested")
+                continue
+        measurements = np.load(target, mmap_mode='r')
+        print(f"{path}: {measurements.shape[0]} rows -> {target} ({os.path.getsize(target) / 1024:.0f} KiB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#the ratio features, defined once and used by training (train_model.py) and serving (app, service, batch scorer).
+#everything works on an (n, 16) float32 array of raw measurements in KEY_MEASUREMENTS order,
+#compute_features turns it into the (n, 11) model input in one pass, no dataframes in between.
+import numpy as np
+
+#columns in the ansur csv files have different names, we match the most relevant ones but more can be added.
+ANSUR_COLUMN_MAPPING = {
+    "STATURE": "stature",
+    "BIACROMIAL_BRTH": "biacromialbreadth",
+    "CHEST_BRTH": "chestbreadth",
+    "CHEST_CIRC": "chestcircumference",
+    "HIP_BRTH": "hipbreadth",
+    "BUTTOCK_CIRC": "buttockcircumference",
+    "WAIST_CIRC-OMPHALION": "waistcircumference",
+    "WAIST_BRTH_OMPHALION": "waistbreadth",
+    "THIGH_CIRC-PROXIMAL": "thighcircumference",
+    "FOREARM_CIRC-FLEXED": "forearmcircumferenceflexed",
+    "WRIST_CIRC-STYLION": "wristcircumference",
+    "ANKLE_CIRC": "anklecircumference",
+    "BIDELTOID_BRTH": "bideltoidbreadth",
+    "CALF_CIRC": "calfcircumference",
+    "FOOT_LNTH": "footlength",
+    "FOREARM-HAND_LENTH": "forearmhandlength"
+}
+
+#the measurements chosen to calculate the ratios on, this is the column order of every measurement array.
+KEY_MEASUREMENTS = [
+    "stature", "biacromialbreadth", "chestbreadth", "chestcircumference",
+    "hipbreadth", "buttockcircumference", "waistcircumference",
+    "waistbreadth", "thighcircumference", "forearmcircumferenceflexed",
+    "wristcircumference", "anklecircumference", "bideltoidbreadth",
+    "calfcircumference", "footlength", "forearmhandlength"
+]
+
+#ratio name: (numerator, denominator). order matters for the model.
+RATIO_FEATURES = {
+    'WHR': ('waistcircumference', 'buttockcircumference'),
+    'HBS': ('hipbreadth', 'stature'),
+    'CS': ('chestcircumference', 'stature'),
+    'FSR': ('forearmcircumferenceflexed', 'stature'),
+    'CBR': ('calfcircumference', 'buttockcircumference'),
+    'BBSR': ('biacromialbreadth', 'stature'),
+    'BBHB': ('biacromialbreadth', 'hipbreadth'),
+    'ANKLS': ('anklecircumference', 'stature'),
+    'FLS': ('forearmhandlength', 'stature'),
+    'WCS': ('wristcircumference', 'stature')
+}
+
+#model input columns, ratios first and stature (in mm) last.
+FEATURE_NAMES = list(RATIO_FEATURES.keys()) + ['stature']
+
+#the raw measurements the features actually use, the rest of KEY_MEASUREMENTS may be missing (nan).
+REQUIRED_MEASUREMENTS = sorted({name for pair in RATIO_FEATURES.values() for name in pair} | {'stature'})
+
+#zeros in the denominator measurements are replaced by this many mm, there aren't any in ansur afaik but just in case
+#other data is added. like the old pandas code it replaces the measurement itself, so it also shows up where that
+#measurement is a numerator (hipbreadth in HBS) and in the stature feature.
+ZERO_DENOMINATOR_MM = 0.1
+
+#the spec "compiled" to column indices once, at import.
+_NUMERATORS = [KEY_MEASUREMENTS.index(numerator) for numerator, _ in RATIO_FEATURES.values()]
+_DENOMINATORS = [KEY_MEASUREMENTS.index(denominator) for _, denominator in RATIO_FEATURES.values()]
+_STATURE = KEY_MEASUREMENTS.index('stature')
+_ZERO_REPLACED = sorted(set(_DENOMINATORS))
+
+
+#(n, 16) float32 measurement array from a dataframe, a dict of columns or a dict of single values (one row).
+#missing measurements become nan. a dataframe that has all of them as float32 (the training frame) is returned
+#as a read only view of its data, nothing is copied.
+def measurement_array(columns):
+    if hasattr(columns, 'to_numpy') and all(name in columns for name in KEY_MEASUREMENTS):
+        return columns[KEY_MEASUREMENTS].to_numpy(dtype=np.float32, copy=False)
+    present = [name for name in KEY_MEASUREMENTS if name in columns]
+    if not present:
+        raise ValueError("no known measurements given")
+    n = len(np.atleast_1d(columns[present[0]]))
+    measurements = np.full((n, len(KEY_MEASUREMENTS)), np.nan, dtype=np.float32)
+    for name in present:
+        measurements[:, KEY_MEASUREMENTS.index(name)] = np.asarray(columns[name], dtype=np.float32)
+    return measurements
+
+
+#(n, 16) measurements -> (n, 11) features. scale converts the input units to mm (10 for cm like the app, 1 for ansur).
+#the ratios don't depend on the units, only stature (and the zero replacement) does.
+def compute_features(measurements, scale=1.0, out=None):
+    measurements = np.asarray(measurements, dtype=np.float32)
+    if out is None:
+        out = np.empty((len(measurements), len(FEATURE_NAMES)), dtype=np.float32)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i, (numerator, denominator) in enumerate(zip(_NUMERATORS, _DENOMINATORS)):
+            np.divide(measurements[:, numerator], measurements[:, denominator], out=out[:, i])
+    np.multiply(measurements[:, _STATURE], scale, out=out[:, -1])
+
+    #slow path, only taken when something divided by zero: the rows with a zero get their zeros replaced
+    #(on a copy of just those rows) and are computed again.
+    if not np.isfinite(out[:, :len(_NUMERATORS)]).all():
+        rows = (measurements[:, _ZERO_REPLACED] == 0).any(axis=1)
+        if rows.any():
+            fixed = measurements[rows]
+            replaced = fixed[:, _ZERO_REPLACED]
+            replaced[replaced == 0] = ZERO_DENOMINATOR_MM / scale
+            fixed[:, _ZERO_REPLACED] = replaced
+            out[rows] = compute_features(fixed, scale)
+    return out
+
+
+def compute_feature_matrix(columns, scale=1.0):
+    return compute_features(measurement_array(columns), scale=scale)
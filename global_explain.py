@@ -0,0 +1,155 @@
+#dataset wide explanation report: mean |shap| per feature, the same per gender, and the strongest feature interactions,
+#over the whole training set. rows are split in chunks and spread over a process pool, every worker loads the model
+#once and runs xgboost's own treeshap (pred_contribs / pred_interactions) single threaded on its chunks.
+#workers only send back sums, so memory stays at one chunk per worker however big the data is.
+#the report is written next to the model (model/model.global.json), the app only reads it.
+#usage: python global_explain.py [--model model/model.joblib] [--workers 4] [--chunk-rows 500]
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from features import FEATURE_NAMES
+
+MODEL_PATH = 'model/model.joblib'
+CHUNK_ROWS = 500
+GENDERS = ('female', 'male')
+TOP_INTERACTIONS = 10
+
+
+def report_path(model_path):
+    return os.path.splitext(model_path)[0] + '.global.json'
+
+
+#worker side, the booster is loaded once per process in the initializer.
+_booster = None
+
+
+def _init_worker(model_path):
+    import joblib
+    global _booster
+    _booster = joblib.load(model_path).get_booster()
+    _booster.set_param({'nthread': 1})
+
+
+#per gender sums over one chunk: |shap|, shap, |interaction| and the row count.
+def explain_chunk(X, y, interactions=True):
+    import xgboost as xgb
+
+    matrix = xgb.DMatrix(X, feature_names=FEATURE_NAMES)
+    #the last column is the bias.
+    contributions = _booster.predict(matrix, pred_contribs=True)[:, :-1]
+    if interactions:
+        interaction_values = np.abs(_booster.predict(matrix, pred_interactions=True)[:, :-1, :-1])
+    n_features = len(FEATURE_NAMES)
+    sums = {
+        'count': np.zeros(len(GENDERS)),
+        'abs_shap': np.zeros((len(GENDERS), n_features)),
+        'shap': np.zeros((len(GENDERS), n_features)),
+        'abs_interaction': np.zeros((len(GENDERS), n_features, n_features)),
+    }
+    for gender in range(len(GENDERS)):
+        rows = y == gender
+        sums['count'][gender] = rows.sum()
+        sums['abs_shap'][gender] = np.abs(contributions[rows]).sum(axis=0)
+        sums['shap'][gender] = contributions[rows].sum(axis=0)
+        if interactions:
+            sums['abs_interaction'][gender] = interaction_values[rows].sum(axis=0)
+    return sums
+
+
+def build_report(X, y, model_path=MODEL_PATH, workers=None, chunk_rows=CHUNK_ROWS, interactions=True):
+    from feature_store import file_sha256
+
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    y = np.asarray(y)
+    workers = workers or os.cpu_count() or 1
+    starts = range(0, len(X), chunk_rows)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model_path,)) as pool:
+        parts = list(pool.map(explain_chunk, (X[s:s + chunk_rows] for s in starts), (y[s:s + chunk_rows] for s in starts),
+                              [interactions] * len(starts)))
+    totals = {name: sum(part[name] for part in parts) for name in parts[0]}
+
+    count = totals['count']
+    by_gender = {}
+    for number, gender in enumerate(GENDERS):
+        by_gender[gender] = {
+            'rows': int(count[number]),
+            'mean_abs_shap': dict(zip(FEATURE_NAMES, (totals['abs_shap'][number] / count[number]).tolist())),
+            'mean_shap': dict(zip(FEATURE_NAMES, (totals['shap'][number] / count[number]).tolist())),
+        }
+    mean_abs = totals['abs_shap'].sum(axis=0) / count.sum()
+
+    report = {
+        'model': model_path,
+        'model_sha256': file_sha256(model_path),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'rows': int(count.sum()),
+        'feature_names': FEATURE_NAMES,
+        'mean_abs_shap': dict(zip(FEATURE_NAMES, mean_abs.tolist())),
+        'ranking': [FEATURE_NAMES[i] for i in np.argsort(-mean_abs)],
+        'by_gender': by_gender,
+        'interactions': [],
+    }
+    if interactions:
+        #phi_ij and phi_ji each hold half of a pair's interaction, the strength of the pair is their sum.
+        mean_interaction = totals['abs_interaction'].sum(axis=0) / count.sum()
+        pairs = [(i, j) for i in range(len(FEATURE_NAMES)) for j in range(i + 1, len(FEATURE_NAMES))]
+        strengths = [2 * mean_interaction[i, j] for i, j in pairs]
+        report['interactions'] = [
+            {'features': [FEATURE_NAMES[i], FEATURE_NAMES[j]], 'mean_abs': float(strength)}
+            for strength, (i, j) in sorted(zip(strengths, pairs), reverse=True)[:TOP_INTERACTIONS]
+        ]
+    return report
+
+
+def save_report(report, path):
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(temporary, path)
+
+
+#the report for this model file, None if there is none or it belongs to another model.
+def load_report(model_path):
+    from feature_store import file_sha256
+
+    try:
+        with open(report_path(model_path)) as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return report if report.get('model_sha256') == file_sha256(model_path) else None
+
+
+def main():
+    from train_model import FEMALE_DATA_PATH, MALE_DATA_PATH, calculate_ratio_features, load_and_preprocess_data
+
+    parser = argparse.ArgumentParser(description="Global shap report over the training set, cached next to the model.")
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--workers', type=int, help="processes to use, defaults to the cpu count")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--no-interactions', action='store_true', help="skip pred_interactions, the slow part")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    df = load_and_preprocess_data(FEMALE_DATA_PATH, MALE_DATA_PATH)
+    #0 female, 1 male like the model's labels.
+    y = (df['gender'] == 'male').to_numpy(dtype=np.int8)
+    report = build_report(calculate_ratio_features(df), y, args.model, args.workers, args.chunk_rows, not args.no_interactions)
+    save_report(report, report_path(args.model))
+
+    print(f"{report['rows']} rows in {time.perf_counter() - start:.1f}s, report saved to {report_path(args.model)}")
+    print(f"{'feature':<10} {'mean |shap|':>12} {'female':>9} {'male':>9}")
+    for name in report['ranking']:
+        print(f"{name:<10} {report['mean_abs_shap'][name]:12.4f} "
+              f"{report['by_gender']['female']['mean_shap'][name]:9.4f} {report['by_gender']['male']['mean_shap'][name]:9.4f}")
+    for pair in report['interactions'][:5]:
+        print(f"interaction {' x '.join(pair['features'])}: {pair['mean_abs']:.4f}")
+
+
+if __name__ == "__main__":
+    main()
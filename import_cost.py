@@ -0,0 +1,80 @@
+#measures how long each module takes to import in a fresh interpreter (python -X importtime), so startup cost can be tracked per release.
+#usage: python import_cost.py [--repeat 5] [--output import_cost.json] [--history import_cost_history.jsonl] [modules ...]
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+#what app.py imports before the form renders, then what it imports in the background for the first prediction.
+STARTUP_MODULES = ['streamlit', 'features', 'prediction_cache', 'timings', 'model_registry', 'percentiles', 'request_log']
+DEFERRED_MODULES = ['joblib', 'xgboost', 'matplotlib.figure', 'explain']
+
+
+#cumulative import time of one module in microseconds, from a cold interpreter.
+def measure_import(module):
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, check=True,
+    )
+    #lines look like "import time:   self [us] | cumulative | imported package", the module itself comes last.
+    for line in reversed(result.stderr.splitlines()):
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.strip() == module:
+            return int(cumulative)
+    raise RuntimeError(f"no importtime line for {module}")
+
+
+def measure(modules, repeat):
+    results = {}
+    for module in modules:
+        samples = [measure_import(module) / 1000 for _ in range(repeat)]
+        results[module] = {'median_ms': statistics.median(samples), 'min_ms': min(samples), 'max_ms': max(samples)}
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold import time per module.")
+    parser.add_argument('modules', nargs='*', help="defaults to the app's startup and deferred modules")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help="write the results to this json file")
+    parser.add_argument('--history', help="append the results as one line to this jsonl file")
+    args = parser.parse_args()
+
+    modules = args.modules or STARTUP_MODULES + DEFERRED_MODULES
+    results = measure(modules, args.repeat)
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'modules': results,
+    }
+    if not args.modules:
+        #the startup modules share dependencies, the slowest one is a lower bound for the form's import cost.
+        report['startup_ms'] = max(results[m]['median_ms'] for m in STARTUP_MODULES)
+        report['deferred_ms'] = max(results[m]['median_ms'] for m in DEFERRED_MODULES)
+
+    for module, timing in results.items():
+        print(f"{module:<20} {timing['median_ms']:9.1f} ms  (min {timing['min_ms']:.1f}, max {timing['max_ms']:.1f})")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.history:
+        with open(args.history, 'a') as f:
+            f.write(json.dumps(report) + '\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#load generator for service.py, sends ansur subjects (converted to cm like the app) from many connections at once.
+#usage: python service.py &  then  python loadgen.py --requests 2000 --concurrency 32 [--endpoint /explain]
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+
+from feature_store import load_measurements
+from features import KEY_MEASUREMENTS, REQUIRED_MEASUREMENTS
+
+FEMALE_DATA_PATH = "data/ANSUR_II_FEMALE_Public.csv"
+MALE_DATA_PATH = "data/ANSUR_II_MALE_Public.csv"
+
+
+#ansur is in mm (from the feature store), the service takes cm.
+def load_payloads():
+    measurements = np.concatenate([load_measurements(path) for path in (FEMALE_DATA_PATH, MALE_DATA_PATH)])
+    columns = [KEY_MEASUREMENTS.index(name) for name in REQUIRED_MEASUREMENTS]
+    return [
+        json.dumps({name: round(float(value) / 10, 2) for name, value in zip(REQUIRED_MEASUREMENTS, row)}).encode()
+        for row in measurements[:, columns]
+    ]
+
+
+async def request(reader, writer, host, method, path, body=b''):
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+async def client(host, port, endpoint, payloads, counter, total, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while True:
+            index = counter[0]
+            if index >= total:
+                break
+            counter[0] += 1
+            start = time.perf_counter()
+            status, _ = await request(reader, writer, host, 'POST', endpoint, payloads[index % len(payloads)])
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def run(host, port, endpoint, total, concurrency, payloads):
+    counter, latencies, errors = [0], [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        client(host, port, endpoint, payloads, counter, total, latencies, errors) for _ in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - start
+
+    reader, writer = await asyncio.open_connection(host, port)
+    _, stats = await request(reader, writer, host, 'GET', '/stats')
+    writer.close()
+    return elapsed, np.array(latencies) * 1000, errors, json.loads(stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for the worminator http service.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--endpoint', choices=['/predict', '/explain'], default='/predict')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    payloads = load_payloads()
+    np.random.default_rng(args.seed).shuffle(payloads)
+
+    elapsed, latencies, errors, stats = asyncio.run(
+        run(args.host, args.port, args.endpoint, args.requests, args.concurrency, payloads)
+    )
+    print(f"{len(latencies)} requests to {args.endpoint} in {elapsed:.2f}s "
+          f"({len(latencies) / elapsed:.0f} req/s, concurrency {args.concurrency}, {len(errors)} errors)")
+    print(f"client latency p50 {np.percentile(latencies, 50):.2f} ms, p99 {np.percentile(latencies, 99):.2f} ms")
+    batch = stats['batch_size']
+    print(f"server batches: {stats['batches']}, batch size mean {batch['mean']:.1f}, max {batch['max']}")
+    for endpoint, latency in stats['latency'].items():
+        print(f"server {endpoint}: p50 {latency['p50_ms']:.2f} ms, p99 {latency['p99_ms']:.2f} ms over {latency['count']} requests")
+
+
+if __name__ == "__main__":
+    main()
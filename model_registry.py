@@ -0,0 +1,232 @@
+#versioned model registry, so a retrained model can be deployed without restarting the app.
+#every version is a directory with the model, its compiled trees and a metadata.json
+#(feature names, hyperparameters, sha256 of the training data, metrics), CURRENT holds the name of the live version.
+#a version directory is written under a temporary name and renamed, CURRENT is replaced atomically,
+#so a reader sees either the old version or the new one, never half of one.
+#RegistryWatcher polls CURRENT in a background thread and swaps in the new model and explainer once they are loaded.
+#usage: python model_registry.py list  /  python model_registry.py publish model/model.joblib  /  python model_registry.py promote v0003
+import argparse
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+from tree_eval import trees_path_for
+
+REGISTRY_DIR = os.environ.get('WORMINATOR_REGISTRY', 'model/registry')
+CURRENT_FILE = 'CURRENT'
+MODEL_FILE = 'model.joblib'
+#named like the trees train_model.py exports next to a model, so tree_eval.load_for_model finds them.
+TREES_FILE = trees_path_for(MODEL_FILE)
+METADATA_FILE = 'metadata.json'
+POLL_SECONDS = float(os.environ.get('WORMINATOR_REGISTRY_POLL', 5))
+
+_VERSION_PATTERN = re.compile(r'^v(\d{4,})$')
+
+#everything a request needs from one version, swapped as a whole so model and explainer always match.
+#forest is the version's compiled trees (tree_eval.py) for single rows, None where they weren't exported
+#(or were exported from another model), then xgboost predicts.
+LoadedModel = namedtuple('LoadedModel', ['version', 'model', 'explainer', 'metadata', 'forest'], defaults=[None])
+
+
+def list_versions(registry_dir=REGISTRY_DIR):
+    if not os.path.isdir(registry_dir):
+        return []
+    return sorted((name for name in os.listdir(registry_dir) if _VERSION_PATTERN.match(name)),
+                  key=lambda name: int(name[1:]))
+
+
+def version_dir(version, registry_dir=REGISTRY_DIR):
+    return os.path.join(registry_dir, version)
+
+
+def current_version(registry_dir=REGISTRY_DIR):
+    try:
+        with open(os.path.join(registry_dir, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def read_metadata(version, registry_dir=REGISTRY_DIR):
+    with open(os.path.join(version_dir(version, registry_dir), METADATA_FILE)) as f:
+        return json.load(f)
+
+
+def set_current(version, registry_dir=REGISTRY_DIR):
+    if not os.path.exists(os.path.join(version_dir(version, registry_dir), METADATA_FILE)):
+        raise ValueError(f"{version} is not in {registry_dir}")
+    temporary = os.path.join(registry_dir, CURRENT_FILE + '.tmp')
+    with open(temporary, 'w') as f:
+        f.write(version + '\n')
+    os.replace(temporary, os.path.join(registry_dir, CURRENT_FILE))
+
+
+#the XGBClassifier hyperparameters that were set. a model pickled by an older xgboost can't always report them,
+#the number of trees is always there.
+def model_hyperparameters(model):
+    try:
+        params = model.get_params()
+    except AttributeError:
+        return {'n_estimators': model.get_booster().num_boosted_rounds()}
+    return {name: value for name, value in params.items()
+            if isinstance(value, (bool, int, float, str)) and value == value}
+
+
+#writes the model as the next version and makes it current unless promote=False.
+def publish(model, hyperparameters=None, data_paths=(), metrics=None, registry_dir=REGISTRY_DIR, promote=True):
+    import joblib
+    import xgboost
+    from feature_store import source_hash
+    from train_model import export_compiled_trees
+
+    os.makedirs(registry_dir, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.staging-', dir=registry_dir)
+    try:
+        #mkdtemp makes it private, workers running as another user need to read it.
+        os.chmod(staging, 0o755)
+        joblib.dump(model, os.path.join(staging, MODEL_FILE))
+        export_compiled_trees(model, os.path.join(staging, TREES_FILE))
+        metadata = {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'feature_names': model.get_booster().feature_names,
+            'hyperparameters': hyperparameters or model_hyperparameters(model),
+            'training_data': {path: source_hash(path) for path in data_paths},
+            'metrics': metrics or {},
+            'xgboost_version': xgboost.__version__,
+        }
+        #two publishers racing for the same number: the loser's rename fails and it tries the next one.
+        while True:
+            existing = list_versions(registry_dir)
+            version = f"v{int(existing[-1][1:]) + 1 if existing else 1:04d}"
+            metadata['version'] = version
+            with open(os.path.join(staging, METADATA_FILE), 'w') as f:
+                json.dump(metadata, f, indent=2)
+            try:
+                os.rename(staging, version_dir(version, registry_dir))
+                break
+            except OSError:
+                if not os.path.exists(version_dir(version, registry_dir)):
+                    raise
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    if promote:
+        set_current(version, registry_dir)
+    print(f"Published {version} to {registry_dir}" + (" (current)" if promote else ""))
+    return version
+
+
+#the pickled XGBClassifier is loaded into memory by every process, nothing of it is shared. single row predictions
+#are served from the compiled trees when the version has them. their node table is a plain .npy opened memory mapped,
+#so workers on the same version share those pages (the traversal's working arrays, a few hundred kB, are per process copies).
+def load_version(version, registry_dir=REGISTRY_DIR, explain_backend=None):
+    import joblib
+    from explain import make_explainer
+    from tree_eval import load_for_model
+
+    model_path = os.path.join(version_dir(version, registry_dir), MODEL_FILE)
+    model = joblib.load(model_path)
+    forest = load_for_model(model, model_path, mmap=True)
+    return LoadedModel(version, model, make_explainer(model, explain_backend), read_metadata(version, registry_dir), forest)
+
+
+#keeps the current version loaded and swaps it when CURRENT changes.
+#a request takes watcher.current once and uses that LoadedModel until it is done, the swap only replaces
+#the reference, so requests in flight finish on the old version and the next one gets the new version.
+class RegistryWatcher:
+    def __init__(self, registry_dir=REGISTRY_DIR, poll_seconds=POLL_SECONDS, explain_backend=None):
+        self.registry_dir = registry_dir
+        self.poll_seconds = poll_seconds
+        self.explain_backend = explain_backend
+        self.current = None
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = None
+        #only one load at a time, a request that needs the model while the watcher is loading it waits for that load.
+        self._lock = threading.Lock()
+
+    #loads the version in CURRENT if it isn't the one being served. a version that fails to load is logged
+    #and the old one keeps serving.
+    def check(self):
+        with self._lock:
+            version = current_version(self.registry_dir)
+            if version is None or (self.current is not None and self.current.version == version):
+                return False
+            try:
+                loaded = load_version(version, self.registry_dir, self.explain_backend)
+            except Exception as error:
+                self.last_error = f"{version}: {error}"
+                print(f"Could not load {version} from {self.registry_dir}: {error}")
+                return False
+            self.current = loaded
+            self.last_error = None
+            return True
+
+    #the version being served, loaded right here if the watcher hasn't got to it yet.
+    def get(self):
+        current = self.current
+        if current is None:
+            self.check()
+            current = self.current
+            if current is None:
+                raise RuntimeError(f"no loadable model in {self.registry_dir}: {self.last_error}")
+        return current
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='worminator-registry', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        self.check()
+        while not self._stop.wait(self.poll_seconds):
+            self.check()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the versioned model registry.")
+    parser.add_argument('--registry', default=REGISTRY_DIR)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('list', help="list versions, * marks the current one")
+    publish_parser = subparsers.add_parser('publish', help="add a saved model as a new version")
+    publish_parser.add_argument('model', help="a joblib file written by train_model.py")
+    publish_parser.add_argument('--data', nargs='*', default=[], help="csvs it was trained on, their hashes go in the metadata")
+    publish_parser.add_argument('--no-promote', action='store_true', help="add it without making it current")
+    promote_parser = subparsers.add_parser('promote', help="make a version current, also for rolling back")
+    promote_parser.add_argument('version')
+    info_parser = subparsers.add_parser('info', help="print a version's metadata")
+    info_parser.add_argument('version', nargs='?')
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        current = current_version(args.registry)
+        for version in list_versions(args.registry):
+            metadata = read_metadata(version, args.registry)
+            metrics = ', '.join(f"{name} {value:.4f}" for name, value in metadata['metrics'].items() if isinstance(value, float))
+            print(f"{'*' if version == current else ' '} {version}  {metadata['created']}  {metrics}")
+    elif args.command == 'publish':
+        import joblib
+        publish(joblib.load(args.model), data_paths=args.data, registry_dir=args.registry, promote=not args.no_promote)
+    elif args.command == 'promote':
+        set_current(args.version, args.registry)
+        print(f"{args.version} is now current")
+    else:
+        version = args.version or current_version(args.registry)
+        if version is None:
+            print(f"Nothing published in {args.registry}")
+            return
+        print(json.dumps(read_metadata(version, args.registry), indent=2))
+
+
+if __name__ == "__main__":
+    main()
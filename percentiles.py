@@ -0,0 +1,48 @@
+#where a ratio (or stature) sits in the female and male ansur populations.
+#train_model.py writes the quantiles of every feature per gender on a 0.1% grid to model/percentiles.npz,
+#the app loads that once and a percentile is a binary search in 1001 sorted values, no csv is read per request.
+#the file is ~90 KB whatever the size of the training data.
+import numpy as np
+
+PERCENTILES_PATH = "model/percentiles.npz"
+#0, 0.1, ..., 100 percent.
+LEVELS = np.linspace(0, 100, 1001)
+GENDERS = ('female', 'male')
+
+
+#quantiles[g, j] are the sorted quantiles of feature j for gender g (0 female, 1 male like the model's labels).
+def build_quantiles(features, labels):
+    features = np.asarray(features, dtype=np.float64)
+    labels = np.asarray(labels)
+    return np.stack([
+        np.nanquantile(features[labels == gender], LEVELS / 100, axis=0).T
+        for gender in range(len(GENDERS))
+    ]).astype(np.float32)
+
+
+class PercentileIndex:
+    def __init__(self, quantiles, feature_names):
+        self.quantiles = quantiles
+        self.feature_names = list(feature_names)
+        self._columns = {name: number for number, name in enumerate(self.feature_names)}
+
+    @classmethod
+    def load(cls, path=PERCENTILES_PATH):
+        with np.load(path) as data:
+            return cls(data['quantiles'], [str(name) for name in data['feature_names']])
+
+    def save(self, path=PERCENTILES_PATH):
+        np.savez(path, quantiles=self.quantiles, feature_names=np.array(self.feature_names))
+
+    #percent of the gender's population with a lower value, linear between the grid points.
+    def percentile(self, feature, value, gender):
+        return float(np.interp(value, self.quantiles[GENDERS.index(gender), self._columns[feature]], LEVELS))
+
+    def median(self, feature, gender):
+        return float(self.quantiles[GENDERS.index(gender), self._columns[feature], len(LEVELS) // 2])
+
+    #{'female': percentile, 'male': percentile} plus the gender whose median is nearer.
+    def describe(self, feature, value):
+        percentiles = {gender: self.percentile(feature, value, gender) for gender in GENDERS}
+        closer = min(GENDERS, key=lambda gender: abs(value - self.median(feature, gender)))
+        return percentiles, closer
@@ -0,0 +1,69 @@
+#small lru cache for the app, so submitting the same measurements again skips the model, shap and the plotting.
+import threading
+from collections import OrderedDict, namedtuple
+
+#everything the app shows for one submission, chart_png is the rendered bar chart.
+CachedPrediction = namedtuple('CachedPrediction', ['probability', 'feature_values', 'shap_values', 'chart_png'])
+
+
+class PredictionCache:
+    def __init__(self, max_size=256):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        #streamlit runs every session in its own thread and the cache is shared between them.
+        self._lock = threading.Lock()
+
+    #the inputs have 2 decimals in the app, rounding makes 170.0 and 170.0000001 the same key.
+    @staticmethod
+    def make_key(values, decimals=2):
+        return tuple(round(float(value), decimals) for value in values)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    #compute runs outside the lock, two sessions missing on the same key at once just both compute it.
+    def get_or_compute(self, key, compute):
+        entry = self.get(key)
+        if entry is None:
+            entry = compute()
+            self.put(key, entry)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,156 @@
+#replays a request log (request_log.py) to reproduce recorded load locally.
+#in process it runs the app's prediction and explanation path (features, predict_proba, shap, optionally the chart),
+#with --url it sends the requests to a running service.py instead.
+#--rate paces the requests (open loop), latency is counted from when a request was due, not from when a worker
+#got to it, so a backlog shows up in the tail instead of quietly lowering the rate. --speedup follows the recorded timing.
+#usage: python replay.py logs/requests.jsonl [--concurrency 8] [--rate 200] [--url 127.0.0.1:8000]
+import argparse
+import http.client
+import itertools
+import json
+import threading
+import time
+
+import numpy as np
+
+from request_log import read_requests
+
+MODEL_PATH = 'model/model.joblib'
+
+
+#the same work the app does per click, without streamlit.
+class LocalTarget:
+    def __init__(self, model_path=MODEL_PATH, explain_backend=None, chart=False):
+        import joblib
+        from explain import make_explainer
+        self.model = joblib.load(model_path)
+        self.explainer = make_explainer(self.model, explain_backend)
+        self.chart = chart
+
+    def connect(self):
+        return None
+
+    def send(self, connection, record):
+        from explain import render_bar_chart
+        from features import FEATURE_NAMES, compute_features, measurement_array
+
+        features = compute_features(measurement_array(record['measurements']), scale=10)
+        self.model.predict_proba(features)
+        if record.get('endpoint') != 'predict':
+            shap_values = self.explainer.shap_values(features)
+            if self.chart:
+                render_bar_chart(shap_values[0], features[0], FEATURE_NAMES)
+        return True
+
+
+#service.py over keep-alive connections, one per worker.
+class HttpTarget:
+    def __init__(self, url):
+        host, _, port = url.replace('http://', '').rstrip('/').partition(':')
+        self.host = host
+        self.port = int(port or 8000)
+
+    def connect(self):
+        return http.client.HTTPConnection(self.host, self.port, timeout=30)
+
+    def send(self, connection, record):
+        endpoint = '/predict' if record.get('endpoint') == 'predict' else '/explain'
+        connection.request('POST', endpoint, json.dumps(record['measurements']), {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        response.read()
+        return response.status == 200
+
+
+#seconds after the start at which each request is due. None means as fast as the workers go.
+def schedule(records, rate=None, speedup=None):
+    if speedup:
+        first = records[0]['ts']
+        return [(record['ts'] - first) / speedup for record in records]
+    if rate:
+        return [index / rate for index in range(len(records))]
+    return None
+
+
+def replay(records, target, concurrency=8, rate=None, speedup=None):
+    due = schedule(records, rate, speedup)
+    counter = itertools.count()
+    latencies = np.zeros(len(records))
+    service_times = np.zeros(len(records))
+    errors = []
+
+    def worker():
+        connection = target.connect()
+        try:
+            while True:
+                index = next(counter)
+                if index >= len(records):
+                    return
+                if due is not None:
+                    delay = start + due[index] - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    scheduled = start + due[index]
+                begin = time.perf_counter()
+                try:
+                    if not target.send(connection, records[index]):
+                        errors.append('non 200 response')
+                except Exception as error:
+                    errors.append(repr(error))
+                    if connection is not None:
+                        connection.close()
+                        connection = target.connect()
+                end = time.perf_counter()
+                service_times[index] = end - begin
+                latencies[index] = end - (scheduled if due is not None else begin)
+        finally:
+            if connection is not None:
+                connection.close()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, latencies * 1000, service_times * 1000, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded requests against the model or the http service.")
+    parser.add_argument('log', help="request log written with WORMINATOR_REQUEST_LOG")
+    parser.add_argument('--url', help="host:port of a running service.py, in process when not given")
+    parser.add_argument('--model', default=MODEL_PATH, help="model for the in process replay")
+    parser.add_argument('--chart', action='store_true', help="also render the bar chart like the app (in process only)")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rate', type=float, help="requests per second, as fast as possible when not given")
+    parser.add_argument('--speedup', type=float, help="follow the recorded timing, this many times faster")
+    parser.add_argument('--requests', type=int, help="replay this many, cycling through the log if it is shorter")
+    parser.add_argument('--endpoint', choices=['predict', 'explain'], help="send everything to this endpoint")
+    args = parser.parse_args()
+
+    records = list(read_requests(args.log))
+    if not records:
+        print(f"No requests in {args.log}")
+        return
+    if args.requests:
+        records = list(itertools.islice(itertools.cycle(records), args.requests))
+    if args.endpoint:
+        records = [{**record, 'endpoint': args.endpoint} for record in records]
+
+    target = HttpTarget(args.url) if args.url else LocalTarget(args.model, chart=args.chart)
+    elapsed, latencies, service_times, errors = replay(records, target, args.concurrency, args.rate, args.speedup)
+
+    where = args.url or 'in process'
+    print(f"{len(records)} requests ({where}) in {elapsed:.2f}s: {len(records) / elapsed:.1f} req/s, "
+          f"concurrency {args.concurrency}, {len(errors)} errors")
+    percentiles = [50, 90, 99, 99.9]
+    print("latency     " + '  '.join(f"p{p} {value:.2f} ms" for p, value in zip(percentiles, np.percentile(latencies, percentiles)))
+          + f"  max {latencies.max():.2f} ms")
+    if args.rate or args.speedup:
+        print("service time " + '  '.join(f"p{p} {value:.2f} ms" for p, value in zip(percentiles, np.percentile(service_times, percentiles))))
+    if errors:
+        print(f"first error: {errors[0]}")
+
+
+if __name__ == "__main__":
+    main()
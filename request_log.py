@@ -0,0 +1,106 @@
+#request log: every submitted set of measurements with its timings, one json object per line, for replay.py.
+#off unless WORMINATOR_REQUEST_LOG is set to a path (logs/requests.jsonl for example).
+#record() only appends to an in-memory queue, a background thread writes whatever has piled up once per
+#flush interval in a single write, so the app and the service never wait on the disk.
+#if the disk can't keep up the queue stops at max_pending and further records are counted as dropped.
+import atexit
+import json
+import os
+import threading
+import time
+from collections import deque
+
+REQUEST_LOG_PATH = os.environ.get('WORMINATOR_REQUEST_LOG')
+FLUSH_SECONDS = 1.0
+MAX_PENDING = 100_000
+
+
+class RequestLog:
+    def __init__(self, path, flush_seconds=FLUSH_SECONDS, max_pending=MAX_PENDING):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.written = 0
+        self.dropped = 0
+        #deque append and popleft are thread safe, no lock on the request path.
+        self._pending = deque()
+        self._wake = threading.Event()
+        self._closed = False
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+        #a crash mid write leaves a partial last line, the next record starts on a line of its own
+        #instead of being glued onto it (read_requests would skip both).
+        if self._file.tell() > 0 and not _ends_with_newline(path):
+            self._file.write('\n')
+        self._writer = threading.Thread(target=self._run, name='worminator-request-log', daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    #measurements in cm as the client sent them, timings in ms.
+    def record(self, source, endpoint, measurements, timings_ms, **extra):
+        if self._closed or len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending.append({
+            'ts': time.time(),
+            'source': source,
+            'endpoint': endpoint,
+            'measurements': measurements,
+            'timings_ms': timings_ms,
+            **extra,
+        })
+
+    def flush(self):
+        lines = []
+        while self._pending:
+            lines.append(json.dumps(self._pending.popleft()) + '\n')
+        if lines:
+            self._file.write(''.join(lines))
+            self._file.flush()
+            self.written += len(lines)
+
+    def _run(self):
+        while not self._wake.wait(self.flush_seconds):
+            self.flush()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._writer.join()
+        self.flush()
+        self._file.close()
+
+
+def _ends_with_newline(path):
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+
+#one log per process and path, shared by every streamlit session and service connection.
+_logs = {}
+_logs_lock = threading.Lock()
+
+
+def get_request_log(path=REQUEST_LOG_PATH):
+    if not path:
+        return None
+    with _logs_lock:
+        log = _logs.get(path)
+        if log is None:
+            log = _logs[path] = RequestLog(path)
+        return log
+
+
+#the recorded requests in order. a crash mid write leaves a partial last line, it is skipped.
+def read_requests(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
@@ -0,0 +1,284 @@
+#headless http service for programmatic clients, no streamlit needed.
+#POST /predict and POST /explain take the same measurements the app collects (json object, in cm).
+#requests that arrive close together are grouped into one predict_proba / shap call (micro-batching).
+#GET /stats reports p50/p99 latency per endpoint and batch size stats.
+#usage: python service.py [--port 8000] [--max-batch-size 64] [--max-wait-ms 5]
+import argparse
+import asyncio
+import json
+import math
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import joblib
+import numpy as np
+
+from explain import EXPLAIN_BACKENDS, make_explainer
+from features import FEATURE_NAMES, REQUIRED_MEASUREMENTS, compute_features, measurement_array
+from request_log import get_request_log
+from tree_eval import SMALL_BATCH_ROWS, load_for_model
+
+MODEL_PATH = 'model/model.joblib'
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+#same as the app: measurements in cm, converted to mm before the ratios are taken.
+def parse_values(body):
+    try:
+        payload = json.loads(body or b'{}')
+    except ValueError:
+        raise ValueError("body is not valid json")
+    if not isinstance(payload, dict):
+        raise ValueError("body must be a json object of measurements")
+
+    missing = [name for name in REQUIRED_MEASUREMENTS if name not in payload]
+    if missing:
+        raise ValueError(f"missing measurements: {', '.join(missing)}")
+    #json numbers only: true is not 1.0, and NaN / Infinity (which python's json accepts) would reach the model
+    #as missing values and could not be written back as valid json.
+    raw = {name: payload[name] for name in REQUIRED_MEASUREMENTS}
+    if any(isinstance(value, bool) or not isinstance(value, (int, float)) for value in raw.values()):
+        raise ValueError("measurements must be numbers")
+    values = {name: float(value) for name, value in raw.items()}
+    if not all(math.isfinite(value) for value in values.values()):
+        raise ValueError("measurements must be finite numbers")
+    if any(value <= 0 for value in values.values()):
+        raise ValueError("Please provide all measurements.")
+    return values
+
+
+#keeps the latest latencies and batch sizes, old ones fall off so memory stays bounded.
+class ServiceStats:
+    def __init__(self, window=10_000):
+        self.latencies = {}
+        self.batch_sizes = deque(maxlen=window)
+        self.batches = 0
+        self.requests = 0
+        self.window = window
+
+    def record_latency(self, endpoint, seconds):
+        self.latencies.setdefault(endpoint, deque(maxlen=self.window)).append(seconds)
+        self.requests += 1
+
+    def record_batch(self, size):
+        self.batch_sizes.append(size)
+        self.batches += 1
+
+    def snapshot(self):
+        endpoints = {}
+        for endpoint, values in self.latencies.items():
+            values = np.fromiter(values, dtype=np.float64) * 1000
+            endpoints[endpoint] = {
+                'count': len(values),
+                'p50_ms': float(np.percentile(values, 50)),
+                'p99_ms': float(np.percentile(values, 99)),
+                'max_ms': float(values.max()),
+            }
+        sizes = np.fromiter(self.batch_sizes, dtype=np.int64)
+        return {
+            'requests': self.requests,
+            'batches': self.batches,
+            'batch_size': {
+                'mean': float(sizes.mean()) if len(sizes) else 0.0,
+                'p50': float(np.percentile(sizes, 50)) if len(sizes) else 0.0,
+                'max': int(sizes.max()) if len(sizes) else 0,
+            },
+            'latency': endpoints,
+        }
+
+
+#collects rows until the batch is full or max_wait_ms has passed since the first one, then runs them together.
+class MicroBatcher:
+    def __init__(self, run_batch, executor, stats, max_batch_size=64, max_wait_ms=5.0):
+        self.run_batch = run_batch
+        self.executor = executor
+        self.stats = stats
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self._worker = None
+
+    def start(self):
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+
+    async def submit(self, row):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((row, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            rows = np.concatenate([row for row, _ in batch])
+            self.stats.record_batch(len(batch))
+            try:
+                #the model runs off the event loop so new requests keep queueing up for the next batch.
+                results = await loop.run_in_executor(self.executor, self.run_batch, rows)
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+class InferenceService:
+    def __init__(self, model, explainer, max_batch_size=64, max_wait_ms=5.0, forest=None):
+        self.model = model
+        self.explainer = explainer
+        #compiled trees (tree_eval.py) for small /predict batches, where they beat xgboost's per call overhead.
+        self.forest = forest
+        self.stats = ServiceStats()
+        #WORMINATOR_REQUEST_LOG records every request for replay.py, None when it isn't set.
+        self.request_log = get_request_log()
+        #one thread, batches run one after another and never fight over the cores xgboost already uses.
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.predict_batcher = MicroBatcher(self.predict_batch, self.executor, self.stats, max_batch_size, max_wait_ms)
+        self.explain_batcher = MicroBatcher(self.explain_batch, self.executor, self.stats, max_batch_size, max_wait_ms)
+
+    def predict_batch(self, rows):
+        X = compute_features(rows, scale=10)
+        predictor = self.forest if self.forest is not None and len(X) <= SMALL_BATCH_ROWS else self.model
+        probabilities = predictor.predict_proba(X)[:, 0]  # class 0 is female
+        return [{'probability_female': float(p)} for p in probabilities]
+
+    def explain_batch(self, rows):
+        X = compute_features(rows, scale=10)
+        probabilities = self.model.predict_proba(X)[:, 0]
+        shap_values = self.explainer.shap_values(X)
+        base_value = float(np.ravel(self.explainer.expected_value)[0])
+        return [
+            {
+                'probability_female': float(p),
+                'base_value': base_value,
+                'features': dict(zip(FEATURE_NAMES, map(float, x))),
+                'shap_values': dict(zip(FEATURE_NAMES, map(float, s))),
+            }
+            for p, x, s in zip(probabilities, X, shap_values)
+        ]
+
+    async def handle(self, method, path, body):
+        if path == '/stats':
+            return 200, self.stats.snapshot()
+        if path not in ('/predict', '/explain'):
+            return 404, {'error': f"unknown path {path}"}
+        if method != 'POST':
+            return 405, {'error': "use POST"}
+
+        try:
+            values = parse_values(body)
+        except ValueError as error:
+            return 400, {'error': str(error)}
+
+        start = time.perf_counter()
+        batcher = self.predict_batcher if path == '/predict' else self.explain_batcher
+        result = await batcher.submit(measurement_array(values))
+        elapsed = time.perf_counter() - start
+        self.stats.record_latency(path, elapsed)
+        if self.request_log is not None:
+            self.request_log.record('service', path.lstrip('/'), values, {'total': elapsed * 1000})
+        return 200, result
+
+    #minimal http/1.1 with keep-alive, enough for json clients and the load generator.
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                body = await reader.readexactly(length) if length else b''
+
+                try:
+                    status, payload = await self.handle(method, path.split('?', 1)[0], body)
+                except Exception as error:
+                    status, payload = 500, {'error': str(error)}
+
+                data = json.dumps(payload).encode()
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(
+                    f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8000):
+        self.predict_batcher.start()
+        self.explain_batcher.start()
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Serving on http://{host}:{port} (POST /predict, POST /explain, GET /stats)")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.predict_batcher.stop()
+            await self.explain_batcher.stop()
+            self.executor.shutdown(wait=False)
+
+
+def load_service(model_path=MODEL_PATH, max_batch_size=64, max_wait_ms=5.0, explain_backend=None):
+    model = joblib.load(model_path)
+    forest = load_for_model(model, model_path)
+    return InferenceService(model, make_explainer(model, explain_backend), max_batch_size, max_wait_ms, forest)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worminator http inference service.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0, help="how long the first request of a batch waits for company")
+    parser.add_argument('--explain-backend', choices=EXPLAIN_BACKENDS, help="defaults to WORMINATOR_EXPLAIN_BACKEND or xgboost")
+    args = parser.parse_args()
+
+    service = load_service(args.model, args.max_batch_size, args.max_wait_ms, args.explain_backend)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#out of core training for datasets bigger than memory.
+#chunks of a csv (KEY_MEASUREMENTS + gender, in mm) or a directory of .npy shards (synth_data.py --format npy)
+#go through an xgboost DataIter, the ratio features are computed per chunk and the raw chunk is dropped right after.
+#"quantile" keeps only the quantized matrix in memory (about 1 byte per feature per row),
+#"external" pages it to disk next to --cache-dir as well, for when even that doesn't fit.
+#usage: python stream_train.py data/synthetic_shards --output model/model_streamed.joblib [--mode external]
+import argparse
+import glob
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+import xgboost as xgb
+
+from features import FEATURE_NAMES, KEY_MEASUREMENTS, compute_features, measurement_array
+
+CHUNK_ROWS = 500_000
+STREAMED_MODEL_PATH = "model/model_streamed.joblib"
+
+
+def csv_chunks(path, chunk_rows):
+    import pandas as pd
+
+    dtypes = {name: np.float32 for name in KEY_MEASUREMENTS}
+    reader = pd.read_csv(path, usecols=KEY_MEASUREMENTS + ['gender'], dtype=dtypes, chunksize=chunk_rows)
+    for chunk in reader:
+        gender = chunk['gender']
+        labels = gender if pd.api.types.is_numeric_dtype(gender) else gender == 'male'
+        yield measurement_array(chunk), labels.to_numpy(dtype=np.float32)
+
+
+def shard_paths(directory):
+    return sorted(path for path in glob.glob(os.path.join(directory, 'shard-*.npy')) if not path.endswith('.labels.npy'))
+
+
+def shard_chunks(directory, chunk_rows):
+    for path in shard_paths(directory):
+        measurements = np.load(path, mmap_mode='r')
+        labels = np.load(path[:-len('.npy')] + '.labels.npy', mmap_mode='r')
+        for start in range(0, len(measurements), chunk_rows):
+            yield measurements[start:start + chunk_rows], np.asarray(labels[start:start + chunk_rows], dtype=np.float32)
+
+
+#hands xgboost one chunk of features at a time, xgboost calls reset() and walks it again when it needs another pass.
+class FeatureChunkIterator(xgb.DataIter):
+    def __init__(self, source, chunk_rows=CHUNK_ROWS, cache_prefix=None):
+        self.source = source
+        self.chunk_rows = chunk_rows
+        self._chunks = None
+        super().__init__(cache_prefix=cache_prefix)
+        self.reset()
+
+    def _make_chunks(self):
+        if os.path.isdir(self.source):
+            return shard_chunks(self.source, self.chunk_rows)
+        return csv_chunks(self.source, self.chunk_rows)
+
+    def reset(self):
+        self._chunks = self._make_chunks()
+
+    def next(self, input_data):
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            return False
+        measurements, labels = chunk
+        input_data(data=compute_features(measurements), label=labels, feature_names=FEATURE_NAMES)
+        return True
+
+
+def build_matrix(source, mode='quantile', chunk_rows=CHUNK_ROWS, cache_dir=None, max_bin=256):
+    if mode == 'external':
+        iterator = FeatureChunkIterator(source, chunk_rows, cache_prefix=os.path.join(cache_dir, 'worminator'))
+        return xgb.ExtMemQuantileDMatrix(iterator, max_bin=max_bin, nthread=-1)
+    return xgb.QuantileDMatrix(FeatureChunkIterator(source, chunk_rows), max_bin=max_bin, nthread=-1)
+
+
+def stream_train(source, mode='quantile', chunk_rows=CHUNK_ROWS, cache_dir=None, hyperparameters=None):
+    from xgboost import XGBClassifier
+    from train_model import load_hyperparameters, to_booster_params
+
+    hyperparameters = hyperparameters or load_hyperparameters()
+    params, rounds = to_booster_params(hyperparameters)
+    #hist with every core for the histogram building.
+    params.update({'tree_method': 'hist', 'nthread': os.cpu_count() or 1})
+
+    matrix = build_matrix(source, mode, chunk_rows, cache_dir)
+    booster = xgb.train(params, matrix, num_boost_round=rounds)
+
+    #wrapped in the same XGBClassifier the app, the service and the batch scorer load.
+    model = XGBClassifier(**hyperparameters)
+    model.load_model(booster.save_raw('json'))
+    return model, matrix.num_row()
+
+
+def peak_memory_mb():
+    #ru_maxrss is in kB on linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    from train_model import export_compiled_trees, save_model
+    from tree_eval import trees_path_for
+
+    parser = argparse.ArgumentParser(description="Train on data that doesn't fit in memory.")
+    parser.add_argument('source', help="csv file (KEY_MEASUREMENTS + gender) or directory of .npy shards")
+    parser.add_argument('--output', default=STREAMED_MODEL_PATH)
+    parser.add_argument('--mode', choices=['quantile', 'external'], default='quantile')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--cache-dir', help="where --mode external pages its data, a temporary directory by default")
+    parser.add_argument('--export-trees', action='store_true',
+                        help="also write the compiled trees next to the model (always done when --output already has some)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(dir=args.cache_dir) as cache_dir:
+        model, rows = stream_train(args.source, args.mode, args.chunk_rows, cache_dir)
+    print(f"Trained on {rows} rows in {time.perf_counter() - start:.1f}s, peak memory {peak_memory_mb():.0f} MB")
+
+    save_model(model, args.output)
+    #trees left from the model this one replaces would be stale, they are overwritten too.
+    trees_path = trees_path_for(args.output)
+    if args.export_trees or os.path.exists(trees_path):
+        export_compiled_trees(model, trees_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#synthetic training data for testing the streaming trainer at scale (10M+ rows) without real data.
+#resamples ansur subjects per gender and multiplies every measurement by a little lognormal noise.
+#writes either one big csv (KEY_MEASUREMENTS + gender, in mm like ansur) or a directory of .npy shards.
+#usage: python synth_data.py --rows 10000000 --output data/synthetic.csv
+#       python synth_data.py --rows 10000000 --output data/synthetic_shards --format npy
+import argparse
+import os
+import time
+
+import numpy as np
+
+from feature_store import load_measurements
+from features import KEY_MEASUREMENTS
+
+FEMALE_DATA_PATH = "data/ANSUR_II_FEMALE_Public.csv"
+MALE_DATA_PATH = "data/ANSUR_II_MALE_Public.csv"
+CHUNK_ROWS = 500_000
+
+
+#yields (measurements, labels) chunks, labels are 1 for male and 0 for female like the training data.
+def synthetic_chunks(rows, noise=0.03, chunk_rows=CHUNK_ROWS, seed=0):
+    rng = np.random.default_rng(seed)
+    female = np.asarray(load_measurements(FEMALE_DATA_PATH))
+    male = np.asarray(load_measurements(MALE_DATA_PATH))
+    male_share = len(male) / (len(male) + len(female))
+
+    for start in range(0, rows, chunk_rows):
+        n = min(chunk_rows, rows - start)
+        labels = (rng.random(n) < male_share).astype(np.int8)
+        measurements = np.where(
+            labels[:, None] == 1,
+            male[rng.integers(0, len(male), n)],
+            female[rng.integers(0, len(female), n)],
+        )
+        measurements *= rng.lognormal(0, noise, measurements.shape).astype(np.float32)
+        yield np.round(measurements, 1), labels
+
+
+def write_csv(path, chunks):
+    import pandas as pd
+
+    for number, (measurements, labels) in enumerate(chunks):
+        df = pd.DataFrame(measurements, columns=KEY_MEASUREMENTS)
+        df['gender'] = np.where(labels == 1, 'male', 'female')
+        df.to_csv(path, mode='w' if number == 0 else 'a', header=number == 0, index=False, float_format='%.1f')
+
+
+#shard-00000.npy holds the (n, 16) measurements, shard-00000.labels.npy the labels.
+def write_shards(directory, chunks):
+    os.makedirs(directory, exist_ok=True)
+    for number, (measurements, labels) in enumerate(chunks):
+        base = os.path.join(directory, f"shard-{number:05d}")
+        np.save(base + '.npy', np.asfortranarray(measurements))
+        np.save(base + '.labels.npy', labels)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic measurement data by resampling ansur with noise.")
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--output', required=True, help="csv file, or directory for --format npy")
+    parser.add_argument('--format', choices=['csv', 'npy'], default='csv')
+    parser.add_argument('--noise', type=float, default=0.03, help="sigma of the multiplicative lognormal noise")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    chunks = synthetic_chunks(args.rows, args.noise, args.chunk_rows, args.seed)
+    if args.format == 'csv':
+        write_csv(args.output, chunks)
+    else:
+        write_shards(args.output, chunks)
+    print(f"Wrote {args.rows} rows to {args.output} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
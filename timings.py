@@ -0,0 +1,191 @@
+#stage timings for the app and the training script, off unless WORMINATOR_TIMINGS=1.
+#every stage goes into a histogram with fixed buckets (like a prometheus histogram), nothing per call is kept.
+#disabled, stage() hands back one shared do-nothing context manager, so the hooks cost a function call.
+#export as a prometheus text file (.prom, for the node exporter textfile collector) or as json.
+#usage: timer = timings.get_timer('app'); with timer.stage('predict'): ...   then   timer.export('metrics/app.prom')
+#long running processes call timer.start_exporter(path) once instead, a background thread exports every few seconds.
+import atexit
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import nullcontext
+
+ENABLED = os.environ.get('WORMINATOR_TIMINGS', '') not in ('', '0')
+METRICS_PATH = os.environ.get('WORMINATOR_METRICS_PATH')
+EXPORT_SECONDS = float(os.environ.get('WORMINATOR_METRICS_INTERVAL', 10))
+#upper bounds in seconds, from the 0.1 ms compiled tree predict up to a full training run.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_DISABLED = nullcontext()
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        #one count per bucket plus the +Inf one, not cumulative, export adds them up.
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    #estimated from the buckets, good enough to see which stage is slow.
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (self.max,), self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class StageTimer:
+    def __init__(self, name, enabled=ENABLED):
+        self.name = name
+        self.enabled = enabled
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._exporter = None
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def stage(self, stage):
+        if not self.enabled:
+            return _DISABLED
+        return _Stage(self, stage)
+
+    #for stages that don't fit in a with block: token = timer.start() ... timer.stop('display', token).
+    def start(self):
+        return time.perf_counter() if self.enabled else None
+
+    def stop(self, stage, token):
+        if token is not None:
+            self.observe(stage, time.perf_counter() - token)
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                stage: {
+                    'count': histogram.count,
+                    'sum_s': histogram.sum,
+                    'mean_s': histogram.sum / histogram.count,
+                    'p50_s': histogram.quantile(0.5),
+                    'p99_s': histogram.quantile(0.99),
+                    'max_s': histogram.max,
+                    'buckets': dict(zip([str(bound) for bound in histogram.buckets] + ['+Inf'], histogram.counts)),
+                }
+                for stage, histogram in self.histograms.items()
+            }
+
+    def to_prometheus(self):
+        metric = f"worminator_{self.name}_stage_seconds"
+        lines = [f"# HELP {metric} Time spent per {self.name} stage.", f"# TYPE {metric} histogram"]
+        with self._lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip([repr(bound) for bound in histogram.buckets] + ['+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{stage="{stage}"}} {histogram.sum!r}')
+                lines.append(f'{metric}_count{{stage="{stage}"}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    #.prom gets the prometheus text format, anything else json. written to a temporary file and renamed
+    #so a scraper never reads half a file. every export gets its own temporary file, so exports from
+    #several threads or processes can't rename each other's file away.
+    def export(self, path):
+        if path.endswith('.prom'):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps({'name': self.name, 'timestamp': time.time(), 'stages': self.snapshot()}, indent=2)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=directory or '.')
+        try:
+            with os.fdopen(descriptor, 'w') as f:
+                f.write(content)
+            os.replace(temporary, path)
+        except BaseException:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+            raise
+
+    #exports every interval seconds from a daemon thread and once more at exit, instead of on the request path.
+    #only the first call starts a thread, so it is safe to call on every streamlit rerun.
+    def start_exporter(self, path, interval=EXPORT_SECONDS):
+        with self._lock:
+            if self._exporter is not None:
+                return self._exporter
+            self._exporter = threading.Thread(target=self._export_every, args=(path, interval),
+                                              name=f'worminator-metrics-{self.name}', daemon=True)
+        self._exporter.start()
+        atexit.register(self._export_quietly, path)
+        return self._exporter
+
+    def _export_every(self, path, interval):
+        while True:
+            time.sleep(interval)
+            self._export_quietly(path)
+
+    def _export_quietly(self, path):
+        try:
+            self.export(path)
+        except OSError as error:
+            print(f"Could not export timings to {path}: {error}")
+
+    def summary(self):
+        lines = [f"{'stage':<16} {'count':>6} {'mean ms':>10} {'max ms':>10}"]
+        for stage, stats in self.snapshot().items():
+            lines.append(f"{stage:<16} {stats['count']:>6} {stats['mean_s'] * 1000:10.2f} {stats['max_s'] * 1000:10.2f}")
+        return '\n'.join(lines)
+
+
+class _Stage:
+    __slots__ = ('timer', 'stage', 'start')
+
+    def __init__(self, timer, stage):
+        self.timer = timer
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+#one timer per process and name, kept here so streamlit reruns keep adding to the same histograms.
+_timers = {}
+
+
+def get_timer(name):
+    timer = _timers.get(name)
+    if timer is None:
+        timer = _timers.setdefault(name, StageTimer(name))
+    return timer
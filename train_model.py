@@ -5,159 +5,282 @@ import pandas as pd
 import numpy as np
 from xgboost import XGBClassifier
 from sklearn.model_selection import train_test_split
+import argparse
+import json
+import os
 import joblib 
+import timings
+from feature_store import load_measurements
+from percentiles import PERCENTILES_PATH, PercentileIndex, build_quantiles
+from features import FEATURE_NAMES, KEY_MEASUREMENTS, compute_features, measurement_array
+from tune import BEST_PARAMS_PATH
+from tree_eval import COMPILED_TREES_PATH, NODE_DTYPE, metadata_path, model_fingerprint, trees_path_for
 
 #file paths
 FEMALE_DATA_PATH = "data/ANSUR_II_FEMALE_Public.csv"
 MALE_DATA_PATH = "data/ANSUR_II_MALE_Public.csv"
 MODEL_SAVE_PATH = "model/model.joblib"
+DISTILLED_MODEL_PATH = "model/model_distilled.joblib"
+DISTILLED_TREES_PATH = trees_path_for(DISTILLED_MODEL_PATH)
 
+#the 16 key measurements come from the feature store (feature_store.py), the csv is parsed once and memory mapped after that.
 def load_and_preprocess_data(female_data_path, male_data_path):
-    female_df = pd.read_csv(female_data_path)
-    male_df = pd.read_csv(male_data_path)
-
-    #columns in the ansur csv files have different names, we match the most relevant ones but more can be added.
-    column_mapping = {
-        "STATURE": "stature",
-        "BIACROMIAL_BRTH": "biacromialbreadth",
-        "CHEST_BRTH": "chestbreadth",
-        "CHEST_CIRC": "chestcircumference",
-        "HIP_BRTH": "hipbreadth",
-        "BUTTOCK_CIRC": "buttockcircumference",
-        "WAIST_CIRC-OMPHALION": "waistcircumference",
-        "WAIST_BRTH_OMPHALION": "waistbreadth",
-        "THIGH_CIRC-PROXIMAL": "thighcircumference",
-        "FOREARM_CIRC-FLEXED": "forearmcircumferenceflexed",
-        "WRIST_CIRC-STYLION": "wristcircumference",
-        "ANKLE_CIRC": "anklecircumference",
-        "BIDELTOID_BRTH": "bideltoidbreadth",
-        "CALF_CIRC": "calfcircumference",
-        "FOOT_LNTH": "footlength",
-        "FOREARM-HAND_LENTH": "forearmhandlength"
-    }
-    male_df = male_df.rename(columns=column_mapping)
-    #the measurements chosen to calculate the ratios on.
-    key_measurements = [
-        "stature", "biacromialbreadth", "chestbreadth", "chestcircumference",
-        "hipbreadth", "buttockcircumference", "waistcircumference",
-        "waistbreadth", "thighcircumference", "forearmcircumferenceflexed",
-        "wristcircumference", "anklecircumference", "bideltoidbreadth",
-        "calfcircumference", "footlength", "forearmhandlength"
-    ]
-
-    female_df = female_df[key_measurements]
-    male_df = male_df[key_measurements]
-    male_df['gender'] = 'male'
-    female_df['gender'] = 'female'
-
-    combined_df = pd.concat([male_df, female_df], ignore_index=True)
+    female = load_measurements(female_data_path)
+    male = load_measurements(male_data_path)
+
+    combined_df = pd.DataFrame(np.concatenate([male, female]), columns=KEY_MEASUREMENTS, copy=False)
+    combined_df['gender'] = np.repeat(['male', 'female'], [len(male), len(female)])
 
     return combined_df
 
-#Calculating the ratios.
+#Calculating the ratios, the spec and the transform are in features.py so the app computes exactly the same thing.
 def calculate_ratio_features(df):
-    ratio_features = {
-        'WHR': ('waistcircumference', 'buttockcircumference'),          
-        'HBS': ('hipbreadth', 'stature'),   
-        'CS': ('chestcircumference', 'stature'),  
-        'FSR': ('forearmcircumferenceflexed', 'stature'),  
-        'CBR': ('calfcircumference', 'buttockcircumference'),   
-        'BBSR': ('biacromialbreadth', 'stature'),              
-        'BBHB': ('biacromialbreadth', 'hipbreadth'),
-        'ANKLS': ('anklecircumference', 'stature'),
-        'FLS': ('forearmhandlength', 'stature'),
-        'WCS': ('wristcircumference', 'stature')
-    }
-
-    #Replace zeros in denominator columns to avoid division by zero ( there aren't any afaik but just in case other data is added)
-    denominator_columns = list(set([denominator for _, denominator in ratio_features.values()]))
-    df[denominator_columns] = df[denominator_columns].replace(0, 0.1)
-
-    #Create the ratio columns.
-    for ratio_name, (numerator, denominator) in ratio_features.items():
-        df[ratio_name] = df[numerator] / df[denominator]
+    return compute_features(measurement_array(df))
 
-    return df, list(ratio_features.keys())
-
-#Preparing training data.
-def prepare_training_data(df, ratio_feature_names):
-    train_df = df[ratio_feature_names + ['stature', 'gender']]
-    train_df['gender'] = train_df['gender'].map({'male': 1, 'female': 0})
-    X = train_df.drop('gender', axis=1)
-    y = train_df['gender'].astype(int)
+#Preparing training data, the frame only wraps the feature array (no copy) so the model keeps the feature names.
+def prepare_training_data(df, features):
+    X = pd.DataFrame(features, columns=FEATURE_NAMES, copy=False)
+    y = (df['gender'] == 'male').astype(int).to_numpy()
     return X, y
 
 #using xgboost.
-#i used bayesian optimization with hyperopt to get these hyperparameters (methode below).
-"""
-from hyperopt import fmin, tpe, hp, Trials, STATUS_OK
-def objective(params):
-    params = {
-        'max_depth': int(params['max_depth']),
-        'min_child_weight': params['min_child_weight'],
-        'learning_rate': params['learning_rate'],
-        'n_estimators': int(params['n_estimators']),
-        'reg_alpha': params['reg_alpha'],
-        'reg_lambda': params['reg_lambda'],
-        'eval_metric': 'logloss',
-        'random_state': 42
-    }
-
-    # Initialize the model with given parameters
-    model = XGBClassifier(**params)
-
-    # Use cross-validation to evaluate the model
-    cv_score = cross_val_score(model, X, y, cv=5, scoring='accuracy').mean()
-    
-    # Return the negative of accuracy because Hyperopt minimizes the objective
-    return {'loss': -cv_score, 'status': STATUS_OK}
-
-space = {
-    'max_depth': hp.quniform('max_depth', 3, 10, 1),
-    'min_child_weight': hp.quniform('min_child_weight', 1, 10, 1),
-    'learning_rate': hp.loguniform('learning_rate', np.log(0.01), np.log(0.2)),
-    'n_estimators': hp.quniform('n_estimators', 50, 300, 10),
-    'reg_alpha': hp.uniform('reg_alpha', 0, 1),
-    'reg_lambda': hp.uniform('reg_lambda', 0, 1)
+#i used bayesian optimization with hyperopt to get these hyperparameters, the search itself is tune.py now.
+#when tune.py has written model/best_params.json those are used instead.
+#changing them will change the models output. 
+TUNED_HYPERPARAMETERS = {
+    'learning_rate': 0.13338404745122975,
+    'max_depth': 8,
+    'min_child_weight': 3,
+    'n_estimators': 250,
+    'reg_alpha': 0.12652039232323586,
+    'reg_lambda': 0.3114131531865676,
+    'eval_metric': 'logloss',
+    'random_state': 42
 }
-trials = Trials()
-best = fmin(fn=objective, space=space, algo=tpe.suggest, max_evals=50, trials=trials)
-best['max_depth'] = int(best['max_depth'])
-best['n_estimators'] = int(best['n_estimators'])
 
-print("Best hyperparameters:", best)
-"""
-#changing them will change the models output. 
-def train_model(X, y):
-    tuned_hyperparameters = {
-        'learning_rate': 0.13338404745122975,
-        'max_depth': 8,
-        'min_child_weight': 3,
-        'n_estimators': 250,
-        'reg_alpha': 0.12652039232323586,
-        'reg_lambda': 0.3114131531865676,
-        'eval_metric': 'logloss',
-        'random_state': 42
+def load_hyperparameters(best_params_path=BEST_PARAMS_PATH):
+    if os.path.exists(best_params_path):
+        with open(best_params_path) as f:
+            best = json.load(f)
+        print(f"Using tuned hyperparameters from {best_params_path} (cv accuracy {best['cv_accuracy']:.4f})")
+        return best['params']
+    return dict(TUNED_HYPERPARAMETERS)
+
+#XGBClassifier style hyperparameters -> params and number of rounds for the native xgb.train (tune.py, stream_train.py).
+def to_booster_params(hyperparameters):
+    params = {
+        'objective': 'binary:logistic',
+        'eval_metric': hyperparameters.get('eval_metric', 'logloss'),
+        'seed': hyperparameters.get('random_state', 0),
+        'max_depth': int(hyperparameters['max_depth']),
+        'min_child_weight': hyperparameters['min_child_weight'],
+        'eta': hyperparameters['learning_rate'],
+        'alpha': hyperparameters['reg_alpha'],
+        'lambda': hyperparameters['reg_lambda'],
     }
-    model = XGBClassifier(**tuned_hyperparameters)
+    return params, int(hyperparameters['n_estimators'])
+
+def train_model(X, y, hyperparameters=None):
+    model = XGBClassifier(**(hyperparameters or load_hyperparameters()))
     model.fit(X, y)
     return model
 
+#distillation: a much smaller model fit to the big model's probabilities instead of the 0/1 labels,
+#for the interactive path where the 250 depth 8 trees cost the most in predict and treeshap.
+#depth 1 trees make an additive model (one shape function per feature), depth 2 adds pairwise interactions.
+#distillation_report() prints the fidelity / accuracy / latency trade-off, WORMINATOR_MODEL=distilled serves it in the app.
+DISTILLED_HYPERPARAMETERS = {
+    'learning_rate': 0.1,
+    'max_depth': 2,
+    'min_child_weight': 1,
+    'n_estimators': 200,
+    'reg_alpha': 0,
+    'reg_lambda': 1,
+    'eval_metric': 'logloss',
+    'random_state': 42
+}
+#(max_depth, n_estimators) pairs the report compares.
+DISTILL_CANDIDATES = [(1, 150), (1, 300), (2, 100), (2, 200), (3, 100), (3, 200)]
+
+#XGBClassifier.fit only takes class labels, the soft targets go through xgb.train and the booster is wrapped afterwards.
+def distill_model(teacher, X, hyperparameters=None):
+    import xgboost as xgb
+    hyperparameters = hyperparameters or DISTILLED_HYPERPARAMETERS
+    params, rounds = to_booster_params(hyperparameters)
+    params['tree_method'] = 'hist'
+    soft_labels = teacher.predict_proba(X)[:, 1]
+    booster = xgb.train(params, xgb.DMatrix(X, label=soft_labels), num_boost_round=rounds)
+    student = XGBClassifier(**hyperparameters)
+    student.load_model(booster.save_raw('json'))
+    return student
+
+#median of single calls, one row is short enough that the mean is mostly noise.
+def _single_row_ms(fn, repeat=200):
+    import time
+    fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return float(np.median(samples)) * 1000
+
+#the teacher here is trained on 80% of the data so every accuracy in the table is on the same unseen 20%.
+#fidelity is how close the student's probabilities are to the teacher's, agreement how often they predict the same class.
+#latencies are one row through predict_proba and the xgboost treeshap explainer, what the app does per click.
+def distillation_report(X, y, teacher_hyperparameters=None):
+    from explain import make_explainer
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
+    teacher = train_model(X_train, y_train, teacher_hyperparameters)
+    teacher_proba = teacher.predict_proba(X_test)[:, 1]
+    row = X_test.to_numpy()[:1]
+
+    def evaluate(name, model):
+        proba = model.predict_proba(X_test)[:, 1]
+        explainer = make_explainer(model, 'xgboost')
+        nodes = sum(len(tree['left_children']) for tree in
+                    json.loads(model.get_booster().save_raw('json'))['learner']['gradient_booster']['model']['trees'])
+        return {
+            'model': name,
+            'nodes': nodes,
+            'fidelity_mae': float(np.abs(proba - teacher_proba).mean()),
+            'agreement': float(((proba > 0.5) == (teacher_proba > 0.5)).mean()),
+            'accuracy': float(((proba > 0.5) == y_test).mean()),
+            'predict_ms': _single_row_ms(lambda: model.predict_proba(row)),
+            'shap_ms': _single_row_ms(lambda: explainer.shap_values(row)),
+        }
+
+    rows = [evaluate('teacher', teacher)]
+    for depth, rounds in DISTILL_CANDIDATES:
+        hyperparameters = {**DISTILLED_HYPERPARAMETERS, 'max_depth': depth, 'n_estimators': rounds}
+        rows.append(evaluate(f"depth {depth} x {rounds}", distill_model(teacher, X_train, hyperparameters)))
+
+    print(f"{'model':<16} {'nodes':>7} {'fidelity':>9} {'agree':>7} {'accuracy':>9} {'predict ms':>11} {'shap ms':>8}")
+    for row_stats in rows:
+        print(f"{row_stats['model']:<16} {row_stats['nodes']:>7} {row_stats['fidelity_mae']:9.4f} {row_stats['agreement']:7.4f} "
+              f"{row_stats['accuracy']:9.4f} {row_stats['predict_ms']:11.3f} {row_stats['shap_ms']:8.3f}")
+    return rows
+
 #save using joblib.
 def save_model(model, save_path):
     joblib.dump(model, save_path)
     print(f"Model saved to {save_path}")
 
+#flattening the trees into plain arrays for tree_eval.py, so serving can score without xgboost, sklearn and joblib.
+def export_compiled_trees(model, save_path):
+    booster = model.get_booster()
+    learner = json.loads(booster.save_raw('json'))['learner']
+    if learner['objective']['name'] != 'binary:logistic':
+        raise ValueError(f"can only export binary:logistic models, not {learner['objective']['name']}")
+    trees = learner['gradient_booster']['model']['trees']
+
+    nodes = np.zeros(sum(len(tree['left_children']) for tree in trees), dtype=NODE_DTYPE)
+    roots = []
+    max_depth = 0
+    offset = 0
+    for tree in trees:
+        left = np.asarray(tree['left_children'], dtype=np.int32)
+        right = np.asarray(tree['right_children'], dtype=np.int32)
+        size = len(left)
+        own = np.arange(offset, offset + size, dtype=np.int32)
+        leaf = left == -1
+        block = nodes[offset:offset + size]
+        block['feature'] = np.where(leaf, 0, tree['split_indices'])
+        block['threshold'] = np.where(leaf, 0, tree['split_conditions'])
+        #leaves loop back to themselves, children get the offset of their tree.
+        block['left'] = np.where(leaf, own, left + offset)
+        block['right'] = np.where(leaf, own, right + offset)
+        block['default_left'] = np.asarray(tree['default_left'], dtype=bool)
+        #for leaves xgboost keeps the leaf value in split_conditions.
+        block['value'] = np.where(leaf, tree['split_conditions'], 0)
+
+        depth = np.zeros(size, dtype=np.int32)
+        for node in range(size):
+            if not leaf[node]:
+                depth[left[node]] = depth[right[node]] = depth[node] + 1
+        max_depth = max(max_depth, int(depth.max()))
+        roots.append(offset)
+        offset += size
+
+    #base_score is a probability for binary:logistic, the trees add to its logit. newer xgboost writes it as "[5E-1]".
+    base_score = float(learner['learner_model_param']['base_score'].strip('[]'))
+    metadata = {
+        'feature_names': booster.feature_names,
+        'base_margin': float(np.log(base_score / (1 - base_score))),
+        'roots': roots,
+        'max_depth': max_depth,
+        'model_fingerprint': model_fingerprint(model),
+    }
+    np.save(save_path, nodes)
+    with open(metadata_path(save_path), 'w') as f:
+        json.dump(metadata, f)
+    print(f"Compiled trees saved to {save_path} ({len(trees)} trees, {len(nodes)} nodes)")
+
+#per gender quantiles of every ratio and stature for the percentiles the app shows (percentiles.py).
+def export_percentile_index(features, y, save_path):
+    PercentileIndex(build_quantiles(features, y), FEATURE_NAMES).save(save_path)
+    print(f"Percentile index saved to {save_path}")
+
 #main.
 if __name__ == "__main__":
-    df = load_and_preprocess_data(FEMALE_DATA_PATH, MALE_DATA_PATH)
+    parser = argparse.ArgumentParser(description="Train the worminator model.")
+    parser.add_argument('--export-only', action='store_true',
+                        help="only re-export the compiled trees from the saved model, no training")
+    parser.add_argument('--register', action='store_true',
+                        help="also publish the model as a new version in the model registry (model_registry.py)")
+    parser.add_argument('--distill', action='store_true',
+                        help="also fit the small surrogate model to the trained model and print the trade-off table")
+    parser.add_argument('--distill-only', action='store_true',
+                        help="only distill from the saved model, no training")
+    args = parser.parse_args()
+
+    if args.export_only:
+        export_compiled_trees(joblib.load(MODEL_SAVE_PATH), COMPILED_TREES_PATH)
+        raise SystemExit
+
+    #WORMINATOR_TIMINGS=1 prints how long each stage took, WORMINATOR_METRICS_PATH also exports them.
+    timer = timings.get_timer('train')
+
+    with timer.stage('load'):
+        df = load_and_preprocess_data(FEMALE_DATA_PATH, MALE_DATA_PATH)
     print(f"Combined DataFrame shape: {df.shape}")
 
-    df, ratio_feature_names = calculate_ratio_features(df)
+    with timer.stage('ratios'):
+        features = calculate_ratio_features(df)
+
+    X, y = prepare_training_data(df, features)
+
+    if args.distill_only:
+        model = joblib.load(MODEL_SAVE_PATH)
+    else:
+        with timer.stage('train'):
+            model = train_model(X, y)
+        print("Model training complete.")
+
+        with timer.stage('save'):
+            save_model(model, MODEL_SAVE_PATH)
+        with timer.stage('export_trees'):
+            export_compiled_trees(model, COMPILED_TREES_PATH)
+        with timer.stage('percentiles'):
+            export_percentile_index(features, y, PERCENTILES_PATH)
 
-    X, y = prepare_training_data(df, ratio_feature_names)
+    if args.distill or args.distill_only:
+        distillation_report(X, y)
+        with timer.stage('distill'):
+            student = distill_model(model, X)
+        save_model(student, DISTILLED_MODEL_PATH)
+        export_compiled_trees(student, DISTILLED_TREES_PATH)
 
-    model = train_model(X, y)
-    print("Model training complete.")
+    if args.register and not args.distill_only:
+        from model_registry import publish
+        metrics = {'train_accuracy': float((model.predict(X) == y).mean()), 'rows': len(X)}
+        if os.path.exists(BEST_PARAMS_PATH):
+            with open(BEST_PARAMS_PATH) as f:
+                metrics['cv_accuracy'] = json.load(f)['cv_accuracy']
+        with timer.stage('register'):
+            publish(model, data_paths=[FEMALE_DATA_PATH, MALE_DATA_PATH], metrics=metrics)
 
-    save_model(model, MODEL_SAVE_PATH)
\ No newline at end of file
+    if timer.enabled:
+        print(timer.summary())
+        if timings.METRICS_PATH:
+            timer.export(timings.METRICS_PATH)
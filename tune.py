@@ -0,0 +1,224 @@
+#hyperparameter search for the xgboost model, replaces the old hyperopt snippet in train_model.py.
+#trials run in parallel over a process pool, every worker builds the 5 cross validation folds once and reuses them.
+#a trial is pruned when its running accuracy after a fold is below the median of the finished trials at that fold.
+#every finished trial is appended to the history file, running the command again resumes where it stopped.
+#trials are stored with their seed (which picks both the params and the folds), a run only resumes from trials of its own seed.
+#the best params go to model/best_params.json, train_model.py picks them up automatically.
+#usage: python tune.py [--trials 50] [--workers 4] [--fresh]
+import argparse
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+TRIALS_PATH = "model/tuning_trials.jsonl"
+BEST_PARAMS_PATH = "model/best_params.json"
+N_FOLDS = 5
+#no pruning before this many folds, one fold is too noisy to judge a trial on.
+MIN_FOLDS_BEFORE_PRUNING = 2
+
+#same search space the hyperopt version used.
+SEARCH_SPACE = {
+    'max_depth': ('int', 3, 10),
+    'min_child_weight': ('int', 1, 10),
+    'learning_rate': ('log', 0.01, 0.2),
+    'n_estimators': ('step', 50, 300, 10),
+    'reg_alpha': ('uniform', 0, 1),
+    'reg_lambda': ('uniform', 0, 1),
+}
+
+#fixed for every trial, also written to best_params.json so XGBClassifier gets the full set.
+FIXED_PARAMS = {'eval_metric': 'logloss', 'random_state': 42}
+
+
+#trial n always gets the same params for a given seed, so a resumed search continues the same sequence.
+def sample_params(trial_number, seed):
+    rng = np.random.default_rng([seed, trial_number])
+    params = {}
+    for name, (kind, *bounds) in SEARCH_SPACE.items():
+        if kind == 'int':
+            params[name] = int(rng.integers(bounds[0], bounds[1] + 1))
+        elif kind == 'step':
+            low, high, step = bounds
+            params[name] = int(low + step * rng.integers(0, (high - low) // step + 1))
+        elif kind == 'log':
+            params[name] = float(np.exp(rng.uniform(np.log(bounds[0]), np.log(bounds[1]))))
+        else:
+            params[name] = float(rng.uniform(bounds[0], bounds[1]))
+    return params
+
+
+def load_history(path=TRIALS_PATH):
+    history = []
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                #an interrupted write leaves a partial last line, that trial just runs again.
+                if line:
+                    try:
+                        history.append(json.loads(line))
+                    except ValueError:
+                        pass
+    return history
+
+
+#cuts a partial last line (an interrupted write) off the history, load_history skipped it already.
+#appending right after it would glue the next trial onto it and lose that one too.
+def drop_partial_line(path):
+    with open(path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - 4096)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b'\n')
+            if newline >= 0:
+                position = start + newline + 1
+                break
+            position = start
+        if position < end:
+            f.truncate(position)
+
+
+#median running accuracy of the finished (not pruned) trials after each fold, what new trials are pruned against.
+def fold_medians(history):
+    complete = [trial['fold_scores'] for trial in history if trial['status'] == 'complete']
+    if not complete:
+        return []
+    running = np.cumsum(np.array(complete), axis=1) / np.arange(1, N_FOLDS + 1)
+    return np.median(running, axis=0).tolist()
+
+
+#worker side. the folds are built once per process in the initializer and reused by every trial it runs.
+_folds = None
+
+
+def _init_worker(X, y, fold_indices):
+    import xgboost as xgb
+    global _folds
+    _folds = [
+        (xgb.DMatrix(X[train], label=y[train], nthread=1), xgb.DMatrix(X[valid], nthread=1), y[valid])
+        for train, valid in fold_indices
+    ]
+
+
+def run_trial(trial_number, params, medians):
+    import xgboost as xgb
+    from train_model import to_booster_params
+
+    start = time.perf_counter()
+    booster_params, rounds = to_booster_params({**params, **FIXED_PARAMS})
+    #one thread per trial, the parallelism comes from running several trials.
+    booster_params.update({'tree_method': 'hist', 'nthread': 1})
+    fold_scores = []
+    status = 'complete'
+    for train, valid, y_valid in _folds:
+        booster = xgb.train(booster_params, train, num_boost_round=rounds)
+        fold_scores.append(float(((booster.predict(valid) > 0.5) == y_valid).mean()))
+        folds_done = len(fold_scores)
+        if folds_done < N_FOLDS and folds_done >= MIN_FOLDS_BEFORE_PRUNING and len(medians) >= folds_done:
+            if np.mean(fold_scores) < medians[folds_done - 1]:
+                status = 'pruned'
+                break
+
+    return {
+        'trial': trial_number,
+        'params': params,
+        'fold_scores': fold_scores,
+        'score': float(np.mean(fold_scores)),
+        'status': status,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def best_trial(history):
+    complete = [trial for trial in history if trial['status'] == 'complete']
+    return max(complete, key=lambda trial: trial['score']) if complete else None
+
+
+def save_best_params(trial, path=BEST_PARAMS_PATH):
+    params = {**trial['params'], **FIXED_PARAMS}
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump({'params': params, 'cv_accuracy': trial['score'], 'trial': trial['trial']}, f, indent=2)
+    os.replace(temporary, path)
+
+
+def prepare_folds(seed):
+    from sklearn.model_selection import StratifiedKFold
+    from train_model import FEMALE_DATA_PATH, MALE_DATA_PATH, calculate_ratio_features, load_and_preprocess_data, prepare_training_data
+
+    df = load_and_preprocess_data(FEMALE_DATA_PATH, MALE_DATA_PATH)
+    X, y = prepare_training_data(df, calculate_ratio_features(df))
+    X = X.to_numpy()
+    folds = list(StratifiedKFold(n_splits=N_FOLDS, shuffle=True, random_state=seed).split(X, y))
+    return X, y, folds
+
+
+def tune(n_trials=50, workers=None, seed=42, trials_path=TRIALS_PATH, best_path=BEST_PARAMS_PATH):
+    history = load_history(trials_path)
+    #other seeds sampled other params and scored them on other folds, their scores don't compare with this run's.
+    other_seeds = sum(trial.get('seed') != seed for trial in history)
+    if other_seeds:
+        print(f"Ignoring {other_seeds} trials in {trials_path} from another seed")
+        history = [trial for trial in history if trial.get('seed') == seed]
+    done = {trial['trial'] for trial in history}
+    pending = [n for n in range(n_trials) if n not in done]
+    if done:
+        print(f"Resuming: {len(done)} trials in {trials_path}, {len(pending)} to go")
+    if not pending:
+        return best_trial(history)
+
+    X, y, folds = prepare_folds(seed)
+    workers = workers or os.cpu_count() or 1
+    best = best_trial(history)
+    if os.path.exists(trials_path):
+        drop_partial_line(trials_path)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(X, y, folds)) as pool, \
+            open(trials_path, 'a') as log:
+        running = set()
+        while pending or running:
+            while pending and len(running) < workers:
+                n = pending.pop(0)
+                running.add(pool.submit(run_trial, n, sample_params(n, seed), fold_medians(history)))
+            finished, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                trial = {**future.result(), 'seed': seed}
+                history.append(trial)
+                log.write(json.dumps(trial) + '\n')
+                log.flush()
+                print(f"trial {trial['trial']:3d} {trial['status']:<8} accuracy {trial['score']:.4f} ({trial['seconds']:.1f}s)")
+                if trial['status'] == 'complete' and (best is None or trial['score'] > best['score']):
+                    best = trial
+                    save_best_params(best, best_path)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel, resumable hyperparameter search.")
+    parser.add_argument('--trials', type=int, default=50, help="total number of trials, including ones already run")
+    parser.add_argument('--workers', type=int, help="processes to use, defaults to the cpu count")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--trials-path', default=TRIALS_PATH)
+    parser.add_argument('--best-path', default=BEST_PARAMS_PATH)
+    parser.add_argument('--fresh', action='store_true', help="forget the trial history and start over")
+    args = parser.parse_args()
+
+    if args.fresh and os.path.exists(args.trials_path):
+        os.remove(args.trials_path)
+
+    best = tune(args.trials, args.workers, args.seed, args.trials_path, args.best_path)
+    if best is None:
+        print("No trial finished.")
+        return
+    save_best_params(best, args.best_path)
+    print(f"Best accuracy {best['score']:.4f} (trial {best['trial']}): {best['params']}")
+    print(f"Saved to {args.best_path}")
+
+
+if __name__ == "__main__":
+    main()